@@ -0,0 +1,102 @@
+"""
+Compare the gunicorn server profiles on the USSD flows.
+
+For every profile in programmable_ussd_project/gunicorn_conf.py this starts a
+gunicorn against a fresh SQLite database, drives concurrent purchase and
+voucher retrieval flows through /ussd_app/interaction/ and reports per-hop
+latency percentiles and throughput.
+
+Usage:
+    python benchmarks/bench_server_profiles.py [--users 20] [--flows 10]
+        [--profiles sync gthread uvicorn]
+"""
+
+import argparse
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import (
+    BASE_DIR,
+    bench_env,
+    free_port,
+    migrate,
+    purchase_flow,
+    retrieval_flow,
+    summarize,
+    wait_for_port,
+)
+
+sys.path.insert(0, str(BASE_DIR))
+from programmable_ussd_project.gunicorn_conf import PROFILES  # noqa: E402
+
+
+def run_profile(name, users, flows_per_user):
+    port = free_port()
+    env = bench_env(GUNICORN_PROFILE=name, GUNICORN_ACCESSLOG="")
+    migrate(env)
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "programmable_ussd_project/gunicorn_conf.py",
+            "--bind",
+            f"127.0.0.1:{port}",
+        ],
+        cwd=BASE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        base_url = f"http://127.0.0.1:{port}"
+        # one warm-up flow so imports and the first connection are not measured
+        purchase_flow(base_url)
+
+        def user(i):
+            hops = []
+            for n in range(flows_per_user):
+                flow = purchase_flow if n % 4 else retrieval_flow
+                hops.extend(flow(base_url, mobile=f"23324{i:07d}"))
+            return hops
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as pool:
+            results = list(pool.map(user, range(users)))
+        wall = time.perf_counter() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    latencies = [hop for hops in results for hop in hops]
+    stats = summarize(latencies)
+    stats["rps"] = len(latencies) / wall
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--flows", type=int, default=10, help="flows per user")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES))
+    args = parser.parse_args()
+
+    print(
+        f"{'profile':<10}{'hops':>8}{'req/s':>10}{'p50 ms':>10}"
+        f"{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    for name in args.profiles:
+        s = run_profile(name, args.users, args.flows)
+        print(
+            f"{name:<10}{s['count']:>8}{s['rps']:>10.1f}{s['p50_ms']:>10.1f}"
+            f"{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
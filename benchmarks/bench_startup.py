@@ -0,0 +1,108 @@
+"""
+Measure the cold-start path of a worker.
+
+Each run starts a fresh interpreter and times: loading the WSGI application
+(Django setup + imports), the optional warm-up step, and the first and second
+/ussd_app/interaction/ requests. Runs alternate between cold and warmed-up
+workers and the medians are reported.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from common import BASE_DIR, bench_env, migrate
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+from programmable_ussd_project.wsgi import application
+t_app = time.perf_counter() - t0
+
+t_warm = 0.0
+if sys.argv[1] == "warm":
+    t0 = time.perf_counter()
+    from ussd_app.warmup import warm_up
+    warm_up()
+    t_warm = time.perf_counter() - t0
+
+from django.test import Client
+client = Client()
+
+def hop(n):
+    body = {"SessionId": f"bench-{n}", "Type": "Initiation", "Mobile": "233240000000"}
+    t0 = time.perf_counter()
+    client.post("/ussd_app/interaction/", json.dumps(body), content_type="application/json")
+    return time.perf_counter() - t0
+
+# requests run on another thread, as in gthread and uvicorn workers, so
+# nothing the warm-up left on this thread (e.g. a DB connection) is reused
+from concurrent.futures import ThreadPoolExecutor
+with ThreadPoolExecutor(1) as pool:
+    first = pool.submit(hop, 1).result()
+    second = pool.submit(hop, 2).result()
+print(json.dumps({"load_app": t_app, "warm_up": t_warm, "first": first, "second": second}))
+"""
+
+MODULES = ("requests", "dotenv", "ussd_app.views", "ussd_app.admin")
+
+
+def run_child(env, mode):
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, mode],
+        cwd=BASE_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def loaded_modules(env):
+    """Which of the interesting modules are imported by just loading the app."""
+    code = (
+        "import sys; from programmable_ussd_project.wsgi import application; "
+        f"print(','.join(m for m in {MODULES!r} if m in sys.modules))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=BASE_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return out.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    env = bench_env(DEBUG="False")
+    migrate(env)
+
+    results = {"cold": [], "warm": []}
+    for _ in range(args.runs):
+        for mode in results:
+            results[mode].append(run_child(env, mode))
+
+    print(f"modules loaded at startup: {loaded_modules(env)}")
+    print(f"{'mode':<6}{'load app':>12}{'warm-up':>12}{'1st req':>12}{'2nd req':>12}")
+    for mode, runs in results.items():
+        med = {k: statistics.median(r[k] for r in runs) * 1000 for k in runs[0]}
+        print(
+            f"{mode:<6}{med['load_app']:>10.1f}ms{med['warm_up']:>10.1f}ms"
+            f"{med['first']:>10.1f}ms{med['second']:>10.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
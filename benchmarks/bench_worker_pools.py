@@ -0,0 +1,147 @@
+"""
+USSD latency under admin load: one shared gunicorn pool vs isolated pools.
+
+For each mode this starts a server against a fresh SQLite database and drives
+concurrent purchase flows through /ussd_app/interaction/, first on their own
+and then while admin threads hammer /admin/login/ with password POSTs (each
+one a CPU-heavy PBKDF2 hash, like any slow back-office action). It reports
+the USSD per-hop percentiles for both phases.
+
+    shared  gunicorn -c gunicorn_conf.py (default gthread profile)
+    pools   python -m programmable_ussd_project.pools
+
+Usage:
+    python benchmarks/bench_worker_pools.py [--users 10] [--flows 10]
+        [--admins 8] [--modes shared pools]
+"""
+
+import argparse
+import http.cookiejar
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from common import (
+    BASE_DIR,
+    bench_env,
+    free_port,
+    migrate,
+    purchase_flow,
+    summarize,
+    wait_for_port,
+)
+
+CSRF_FIELD = re.compile(rb'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def server_command(mode, port):
+    if mode == "shared":
+        return [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "programmable_ussd_project/gunicorn_conf.py",
+            "--bind",
+            f"127.0.0.1:{port}",
+        ]
+    return [sys.executable, "-m", "programmable_ussd_project.pools", "--bind", f"127.0.0.1:{port}"]
+
+
+def admin_load(base_url, stop, counter):
+    """Failed admin logins in a loop until `stop` is set."""
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+    )
+    login_url = f"{base_url}/admin/login/"
+    while not stop.is_set():
+        try:
+            with opener.open(login_url, timeout=60) as resp:
+                token = CSRF_FIELD.search(resp.read()).group(1).decode()
+            body = urllib.parse.urlencode(
+                {"csrfmiddlewaretoken": token, "username": "admin", "password": "wrong"}
+            ).encode()
+            with opener.open(login_url, data=body, timeout=60) as resp:
+                resp.read()
+            counter.append(1)
+        except OSError:
+            time.sleep(0.05)
+
+
+def ussd_phase(base_url, users, flows_per_user):
+    def user(i):
+        hops = []
+        for _ in range(flows_per_user):
+            hops.extend(purchase_flow(base_url, mobile=f"23324{i:07d}"))
+        return hops
+
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        return [hop for hops in pool.map(user, range(users)) for hop in hops]
+
+
+def run_mode(mode, users, flows_per_user, admins):
+    port = free_port()
+    env = bench_env(GUNICORN_ACCESSLOG="")
+    migrate(env)
+    server = subprocess.Popen(
+        server_command(mode, port),
+        cwd=BASE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port, timeout=60)
+        base_url = f"http://127.0.0.1:{port}"
+        purchase_flow(base_url)  # warm-up
+
+        idle = ussd_phase(base_url, users, flows_per_user)
+
+        stop = threading.Event()
+        logins = []
+        load = [
+            threading.Thread(target=admin_load, args=(base_url, stop, logins))
+            for _ in range(admins)
+        ]
+        for t in load:
+            t.start()
+        time.sleep(1)  # let the admin load saturate its workers first
+        loaded = ussd_phase(base_url, users, flows_per_user)
+        stop.set()
+        for t in load:
+            t.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+    return summarize(idle), summarize(loaded), len(logins)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--flows", type=int, default=10, help="flows per user")
+    parser.add_argument("--admins", type=int, default=8, help="concurrent admin threads")
+    parser.add_argument("--modes", nargs="+", default=["shared", "pools"])
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':<8}{'phase':<12}{'hops':>8}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'max ms':>10}{'logins':>8}"
+    )
+    for mode in args.modes:
+        idle, loaded, logins = run_mode(mode, args.users, args.flows, args.admins)
+        for phase, s, n in (("idle", idle, ""), ("admin load", loaded, logins)):
+            print(
+                f"{mode:<8}{phase:<12}{s['count']:>8}{s['p50_ms']:>10.1f}"
+                f"{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}{n:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
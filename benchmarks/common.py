@@ -0,0 +1,142 @@
+"""
+Shared helpers for the benchmark scripts in this directory.
+
+The benchmarks talk to a real server over HTTP with nothing but the standard
+library, so they can run against a local gunicorn or a staging instance.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+def bench_env(**extra):
+    """Environment for a throwaway server backed by a temporary SQLite file."""
+    env = dict(os.environ)
+    env.setdefault("SECRET_KEY", "benchmark-secret-key")
+    env["DEBUG"] = "False"
+    if "SQLITE_PATH" not in extra:
+        env["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    env.update({k: str(v) for k, v in extra.items()})
+    return env
+
+
+def migrate(env):
+    subprocess.run(
+        [sys.executable, "manage.py", "migrate", "--no-input", "-v", "0"],
+        cwd=BASE_DIR,
+        env=env,
+        check=True,
+    )
+
+
+def post_json(url, payload, timeout=30):
+    body = json.dumps(payload).encode()
+    req = urllib.request.Request(
+        url, data=body, headers={"Content-Type": "application/json"}
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        data = resp.read()
+    return time.perf_counter() - start, json.loads(data)
+
+
+def purchase_flow(base_url, mobile="233240000000"):
+    """Drive one full WASSCE purchase through /interaction/, return hop latencies."""
+    session_id = uuid.uuid4().hex
+    url = f"{base_url}/ussd_app/interaction/"
+    hops = [
+        ("Initiation", ""),
+        ("Response", "1"),
+        ("Response", "1"),
+        ("Response", "Ama Mensah"),
+        ("Response", "0240000000"),
+        ("Response", "1"),
+    ]
+    latencies = []
+    for seq, (msg_type, message) in enumerate(hops, start=1):
+        elapsed, _ = post_json(
+            url,
+            {
+                "SessionId": session_id,
+                "Type": msg_type,
+                "Message": message,
+                "Mobile": mobile,
+                "Sequence": seq,
+                "ClientState": "",
+            },
+        )
+        latencies.append(elapsed)
+    return latencies
+
+
+def retrieval_flow(base_url, mobile="233240000000"):
+    """Drive the voucher retrieval branch (steps 101-102)."""
+    session_id = uuid.uuid4().hex
+    url = f"{base_url}/ussd_app/interaction/"
+    hops = [
+        ("Initiation", ""),
+        ("Response", "2"),
+        ("Response", "Ama Mensah"),
+        ("Response", "0240000000"),
+    ]
+    latencies = []
+    for seq, (msg_type, message) in enumerate(hops, start=1):
+        elapsed, _ = post_json(
+            url,
+            {
+                "SessionId": session_id,
+                "Type": msg_type,
+                "Message": message,
+                "Mobile": mobile,
+                "Sequence": seq,
+            },
+        )
+        latencies.append(elapsed)
+    return latencies
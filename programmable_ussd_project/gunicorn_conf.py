@@ -0,0 +1,204 @@
+"""
+Gunicorn configuration for programmable_ussd_project.
+
+Pick a server profile with the GUNICORN_PROFILE environment variable:
+
+    sync     - classic pre-fork sync workers, one request per process
+    gthread  - threaded workers (default); a blocked Hubtel callback only
+               holds one thread instead of a whole process
+    uvicorn  - uvicorn workers (uvicorn-worker package) serving the ASGI
+               application
+
+Usage:
+    gunicorn -c programmable_ussd_project/gunicorn_conf.py
+
+Every value can still be overridden from the environment
+(WEB_CONCURRENCY, GUNICORN_THREADS, GUNICORN_TIMEOUT, ...) or on the
+gunicorn command line.
+
+Isolated pools: with GUNICORN_POOL set to one of POOLS, this server is one
+pool of a split deployment and takes that pool's workers, threads, timeout
+and listen backlog (overridable as GUNICORN_<POOL>_WORKERS, _THREADS, ...).
+programmable_ussd_project/pools.py starts one gunicorn per pool and routes
+each request to them by URL prefix:
+
+    web: python -m programmable_ussd_project.pools
+"""
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+# Hubtel waits a few seconds for a USSD reply, but fulfillment may retry the
+# callback up to 3 x 10s, so the worker timeout must outlive that.
+HUBTEL_REQUEST_TIMEOUT = 45
+
+PROFILES = {
+    "sync": {
+        "worker_class": "sync",
+        "workers": CPU_COUNT * 2 + 1,
+        "threads": 1,
+        "wsgi_app": "programmable_ussd_project.wsgi:application",
+    },
+    "gthread": {
+        "worker_class": "gthread",
+        "workers": CPU_COUNT + 1,
+        "threads": 4,
+        "wsgi_app": "programmable_ussd_project.wsgi:application",
+    },
+    "uvicorn": {
+        "worker_class": "uvicorn_worker.UvicornWorker",
+        "workers": CPU_COUNT + 1,
+        "threads": 1,
+        "wsgi_app": "programmable_ussd_project.asgi:application",
+    },
+}
+
+DEFAULT_PROFILE = "gthread"
+
+# Separate gunicorn masters, so each has its own worker limit and its own
+# listen queue; slow admin work cannot take workers from live USSD sessions.
+# The first pool whose prefix matches the request path serves it.
+POOLS = {
+    "ussd": {
+        "prefixes": ("/ussd_app/interaction/",),
+        "workers": CPU_COUNT + 1,
+        "threads": 4,
+        # replies are bounded by USSD_DEADLINE_SECONDS; a worker stuck far
+        # past that is better restarted
+        "timeout": 15,
+        # a short queue: Hubtel gives up on a hop after a few seconds anyway
+        "backlog": 64,
+    },
+    "fulfillment": {
+        "prefixes": ("/ussd_app/fulfillment/",),
+        "workers": 2,
+        "threads": 8,
+        "timeout": HUBTEL_REQUEST_TIMEOUT,
+        "backlog": 512,
+    },
+    "admin": {
+        "prefixes": ("/",),
+        "workers": 1,
+        "threads": 4,
+        "timeout": 60,  # recheck_status blocks on Hubtel for up to 15s
+        "backlog": 128,
+    },
+}
+
+
+def get_profile(name=None):
+    """Return the settings dict for a named profile (falls back to the default)."""
+    name = (name or os.getenv("GUNICORN_PROFILE") or DEFAULT_PROFILE).lower()
+    if name not in PROFILES:
+        raise ValueError(
+            f"Unknown GUNICORN_PROFILE {name!r}, choose one of: {', '.join(PROFILES)}"
+        )
+    return name, PROFILES[name]
+
+
+def get_pool(name):
+    """Settings of a pool with GUNICORN_<POOL>_* environment overrides applied."""
+    if name not in POOLS:
+        raise ValueError(f"Unknown GUNICORN_POOL {name!r}, choose one of: {', '.join(POOLS)}")
+    pool = dict(POOLS[name])
+    for key in ("workers", "threads", "timeout", "backlog"):
+        pool[key] = int(os.getenv(f"GUNICORN_{name.upper()}_{key.upper()}", pool[key]))
+    return pool
+
+
+profile_name, profile = get_profile()
+pool_name = os.getenv("GUNICORN_POOL")
+
+wsgi_app = os.getenv("GUNICORN_APP", profile["wsgi_app"])
+worker_class = profile["worker_class"]
+workers = int(os.getenv("WEB_CONCURRENCY", profile["workers"]))
+threads = int(os.getenv("GUNICORN_THREADS", profile["threads"]))
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+backlog = int(os.getenv("GUNICORN_BACKLOG", 2048))
+
+# Load Django once in the master so workers fork with everything imported.
+preload_app = os.getenv("GUNICORN_PRELOAD", "True") == "True"
+
+# Recycle workers periodically; jitter keeps them from restarting together.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", HUBTEL_REQUEST_TIMEOUT))
+
+if pool_name:
+    _pool = get_pool(pool_name)
+    workers, threads = _pool["workers"], _pool["threads"]
+    timeout, backlog = _pool["timeout"], _pool["backlog"]
+    proc_name = f"ussd-{pool_name}"
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+# Hubtel sits behind a load balancer that reuses connections between hops.
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-") or None
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
+
+
+def post_worker_init(worker):
+    """Prime the price cache and URL resolver before taking traffic."""
+    if "uvicorn" in worker.cfg.worker_class_str.lower():
+        watch_memory_budget(worker)
+    if os.getenv("GUNICORN_WARMUP", "True") != "True":
+        return
+    from ussd_app.warmup import warm_up
+
+    try:
+        warm_up()
+    except Exception:
+        worker.log.exception("Warm-up failed, serving cold")
+
+
+def worker_exit(server, worker):
+    """Write the worker's pending funnel counts before it goes away."""
+    from django.db import connection
+
+    from ussd_app import funnel
+
+    try:
+        funnel.flush()
+    except Exception:
+        worker.log.exception("Funnel counter flush failed on exit")
+    finally:
+        connection.close()
+
+
+def watch_memory_budget(worker, interval=5):
+    """
+    Leak guard for uvicorn workers, which never call post_request: poll RSS
+    and send the worker SIGTERM once it is over its memory budget.
+    """
+    from django.conf import settings
+
+    from ussd_app.memory import over_budget
+
+    if not settings.USSD_MEMORY_BUDGET_MB:
+        return None
+
+    def watch():
+        while not over_budget():
+            time.sleep(interval)
+        worker.log.warning("Worker %s over memory budget, recycling", worker.pid)
+        os.kill(worker.pid, signal.SIGTERM)
+
+    thread = threading.Thread(target=watch, name="memory-budget", daemon=True)
+    thread.start()
+    return thread
+
+
+def post_request(worker, req, environ, resp):
+    """Leak guard: stop this worker gracefully once it is over its memory budget."""
+    from ussd_app.memory import over_budget
+
+    if worker.alive and over_budget():
+        worker.log.warning("Worker %s over memory budget, recycling", worker.pid)
+        worker.alive = False
@@ -0,0 +1,251 @@
+"""
+Run the isolated gunicorn pools behind a small request router.
+
+    python -m programmable_ussd_project.pools [--bind 0.0.0.0:$PORT]
+
+Starts one gunicorn per entry of POOLS in gunicorn_conf.py (GUNICORN_POOL set,
+each on its own unix socket), then accepts connections on --bind and routes
+every request to the pool whose URL prefix matches its path.
+
+Routing is per request, not per connection: Hubtel's load balancer keeps
+connections alive and may send interaction, fulfillment and admin requests
+down the same one. The router reads each request head, frames its body
+(Content-Length or chunked), and sends it to its pool over a fresh unix
+socket connection marked Connection: close; the response is relayed until
+the pool closes it. The client connection itself stays kept alive whenever
+the response is self-delimiting, so pipelined requests work too.
+
+If any pool exits, the launcher stops the others and exits non-zero so the
+platform restarts the whole set.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from programmable_ussd_project.gunicorn_conf import POOLS
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CONFIG = "programmable_ussd_project/gunicorn_conf.py"
+BAD_GATEWAY = b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+# per-connection headers; Expect is answered here rather than by the pool
+HOP_BY_HOP = {"connection", "keep-alive", "expect"}
+
+
+def pick_pool(path):
+    """Name of the first pool whose prefix matches `path`."""
+    for name, pool in POOLS.items():
+        if path.startswith(pool["prefixes"]):
+            return name
+    raise LookupError(f"no pool serves {path!r}")
+
+
+def start_pools(socket_dir):
+    """Start one gunicorn master per pool, return {name: (process, socket path)}."""
+    pools = {}
+    for name in POOLS:
+        sock = os.path.join(socket_dir, f"{name}.sock")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", CONFIG, "--bind", f"unix:{sock}"],
+            cwd=BASE_DIR,
+            env={**os.environ, "GUNICORN_POOL": name},
+        )
+        pools[name] = (process, sock)
+    deadline = time.monotonic() + 60
+    for name, (process, sock) in pools.items():
+        while not os.path.exists(sock):
+            if process.poll() is not None or time.monotonic() > deadline:
+                stop_pools(pools)
+                raise RuntimeError(f"pool {name!r} did not start")
+            time.sleep(0.1)
+    return pools
+
+
+def stop_pools(pools, timeout=30):
+    for process, _ in pools.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    for process, _ in pools.values():
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def relay(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except OSError:
+        pass  # either side went away
+
+
+async def relay_exactly(reader, writer, size):
+    while size > 0:
+        data = await reader.readexactly(min(size, 65536))
+        writer.write(data)
+        await writer.drain()
+        size -= len(data)
+
+
+async def relay_body(reader, writer, headers):
+    """Relay one request body, framed by Transfer-Encoding or Content-Length."""
+    if "chunked" in header_value(headers, "transfer-encoding"):
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            writer.write(size_line)
+            size = int(size_line.split(b";")[0], 16)
+            if size == 0:
+                break
+            await relay_exactly(reader, writer, size + 2)  # chunk and its CRLF
+        while True:  # trailers up to the blank line
+            line = await reader.readuntil(b"\r\n")
+            writer.write(line)
+            if line == b"\r\n":
+                break
+    else:
+        await relay_exactly(reader, writer, int(header_value(headers, "content-length") or 0))
+
+
+def parse_head(head):
+    """Split a message head into its start line and [(name, value)] headers."""
+    start, *lines = head.decode("latin-1").split("\r\n")
+    headers = []
+    for line in lines:
+        if line:
+            name, _, value = line.partition(":")
+            headers.append((name.strip(), value.strip()))
+    return start, headers
+
+
+def build_head(start, headers):
+    lines = [start, *(f"{name}: {value}" for name, value in headers), "", ""]
+    return "\r\n".join(lines).encode("latin-1")
+
+
+def header_value(headers, name):
+    """Comma-joined, lowercased values of header `name`."""
+    return ", ".join(v for n, v in headers if n.lower() == name).lower()
+
+
+def end_to_end(headers):
+    """Headers minus those that only apply to one hop, which the router sets itself."""
+    return [(n, v) for n, v in headers if n.lower() not in HOP_BY_HOP]
+
+
+class Router:
+    def __init__(self, sockets):
+        self.sockets = sockets
+
+    async def handle(self, client_reader, client_writer):
+        try:
+            while await self.forward(client_reader, client_writer):
+                pass
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, OSError):
+            pass  # client went away or sent a request that cannot be framed
+        finally:
+            client_writer.close()
+
+    async def forward(self, client_reader, client_writer):
+        """Route one request and relay its response; True if the connection stays open."""
+        try:
+            head = await client_reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return False  # client closed between requests
+        request_line, headers = parse_head(head)
+        parts = request_line.split(" ")
+        method, path, version = parts if len(parts) == 3 else ("GET", "/", "HTTP/1.0")
+        keep_alive = version == "HTTP/1.1" and "close" not in header_value(headers, "connection")
+        if "100-continue" in header_value(headers, "expect"):
+            client_writer.write(CONTINUE)
+
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_unix_connection(
+                self.sockets[pick_pool(path)]
+            )
+        except OSError:
+            client_writer.write(BAD_GATEWAY)
+            return False
+        try:
+            upstream_writer.write(
+                build_head(request_line, [*end_to_end(headers), ("Connection", "close")])
+            )
+            await relay_body(client_reader, upstream_writer, headers)
+            await upstream_writer.drain()
+            try:
+                status_line, response_headers = parse_head(
+                    await upstream_reader.readuntil(b"\r\n\r\n")
+                )
+            except (asyncio.IncompleteReadError, OSError):
+                client_writer.write(BAD_GATEWAY)
+                return False
+            status = int(status_line.split(" ")[1])
+            # a body that ends only when the pool closes ends this connection too
+            delimited = (
+                method == "HEAD"
+                or status in (204, 304)
+                or "chunked" in header_value(response_headers, "transfer-encoding")
+                or bool(header_value(response_headers, "content-length"))
+            )
+            keep_alive = keep_alive and delimited
+            response_headers = end_to_end(response_headers)
+            if not keep_alive:
+                response_headers.append(("Connection", "close"))
+            client_writer.write(build_head(status_line, response_headers))
+            # the pool closes its side after this one response
+            await relay(upstream_reader, client_writer)
+        finally:
+            upstream_writer.close()
+        return keep_alive
+
+
+async def serve(host, port, pools):
+    router = Router({name: sock for name, (_, sock) in pools.items()})
+    server = await asyncio.start_server(router.handle, host, port, backlog=2048)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    exit_code = 0
+    async with server:
+        while not stop.is_set():
+            exited = [name for name, (process, _) in pools.items() if process.poll() is not None]
+            if exited:
+                print(f"pool(s) {', '.join(exited)} exited, shutting down", file=sys.stderr)
+                exit_code = 1
+                break
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bind", default=f"0.0.0.0:{os.getenv('PORT', '8000')}")
+    args = parser.parse_args()
+    host, _, port = args.bind.rpartition(":")
+
+    socket_dir = tempfile.mkdtemp(prefix="ussd-pools-")
+    pools = start_pools(socket_dir)
+    try:
+        exit_code = asyncio.run(serve(host or "0.0.0.0", int(port), pools))
+    finally:
+        stop_pools(pools)
+        shutil.rmtree(socket_dir, ignore_errors=True)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
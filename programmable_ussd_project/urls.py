@@ -19,9 +19,15 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import HttpResponse
 
+from ussd_app.admin import worker_memory
 
 urlpatterns = [
     path("", lambda request: HttpResponse("Welcome to the USSD Gateway!")),
+    path(
+        "admin/worker-memory/",
+        admin.site.admin_view(worker_memory),
+        name="admin-worker-memory",
+    ),
     path("admin/", admin.site.urls),
     path("ussd_app/", include("ussd_app.urls")),
 ]
@@ -1,10 +1,68 @@
+from datetime import timedelta
 from django.contrib import admin, messages
-from .models import Price, USSDSession, Transaction, RetrievalRequest
+from django.contrib.admin.views.main import ChangeList
+import json
+from .models import (
+    CustomerProfile,
+    Price,
+    USSDSession,
+    Transaction,
+    RetrievalRequest,
+    FunnelCounter,
+    ProfileCapture,
+    ProviderPayload,
+)
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
 from django.utils.html import format_html
-from django.urls import path
-from django.shortcuts import redirect
+from django.urls import path, reverse
+from django.shortcuts import redirect, render
 from django.conf import settings
-import requests
+from django.http import HttpResponse, JsonResponse
+from . import memory
+from .circuit_breaker import breaker_states
+from .hubtel import check_transaction_status
+from .db_router import read_from_replica
+from .retrieval import rematch
+from .search import IndexedSearchMixin
+
+
+class DeferredChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        qs = super().get_queryset(request, exclude_parameters)
+        return qs.defer(*self.model_admin.list_defer)
+
+
+class DeferredListMixin:
+    """
+    Leave bulky JSON columns out of the changelist query. list_defer takes
+    field paths, so "session__data" also skips a column of a related row
+    that list_display pulls in through select_related.
+    """
+
+    list_defer = ()
+
+    def get_changelist(self, request, **kwargs):
+        return DeferredChangeList
+
+
+class ReplicaReadMixin:
+    """
+    Build changelists (list, search, filters, counts) from the read replica.
+    Only GET/HEAD: a POST runs an admin action or saves list_editable rows,
+    which must select what they change from the primary.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method not in ("GET", "HEAD"):
+            return super().changelist_view(request, extra_context)
+        with read_from_replica():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, "render"):
+                # TemplateResponse evaluates the querysets while rendering
+                response.render()
+        return response
 
 
 # Register your models here.
@@ -15,10 +73,15 @@ class PriceAdmin(admin.ModelAdmin):
 
 
 @admin.register(USSDSession)
-class USSDSessionAdmin(admin.ModelAdmin):
+class USSDSessionAdmin(
+    ReplicaReadMixin, DeferredListMixin, IndexedSearchMixin, admin.ModelAdmin
+):
     list_display = ("session_id", "mobile", "step", "updated_at")
     readonly_fields = ("created_at", "updated_at")
     search_fields = ("session_id", "mobile")
+    list_defer = ("data",)
+    prefix_search_fields = ("session_id",)
+    phone_search_fields = ("mobile",)
 
 
 # @admin.register(Transaction)
@@ -36,8 +99,26 @@ class USSDSessionAdmin(admin.ModelAdmin):
 #     search_fields = ("order_id", "client_reference", "mobile")
 
 
+class ProviderPayloadInline(admin.TabularInline):
+    model = ProviderPayload
+    fields = ("kind", "created_at", "pretty_payload")
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def pretty_payload(self, obj):
+        return format_html("<pre>{}</pre>", json.dumps(obj.payload(), indent=2))
+
+    pretty_payload.short_description = "Payload"
+
+
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(
+    ReplicaReadMixin, DeferredListMixin, IndexedSearchMixin, admin.ModelAdmin
+):
     list_display = (
         "id",
         "session",
@@ -48,9 +129,12 @@ class TransactionAdmin(admin.ModelAdmin):
         "created_at",
         "recheck_button",
     )
-    readonly_fields = ("created_at", "updated_at")
+    readonly_fields = ("created_at", "updated_at", "match_name", "match_phone")
     list_filter = ("status",)
+    inlines = (ProviderPayloadInline,)
+    list_defer = ("extra", "session__data")
     search_fields = ("client_reference", "order_id")
+    prefix_search_fields = ("client_reference", "order_id")
 
     def get_urls(self):
         urls = super().get_urls()
@@ -60,6 +144,11 @@ class TransactionAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.recheck_status),
                 name="transaction-recheck",
             ),
+            path(
+                "hubtel-breakers/",
+                self.admin_site.admin_view(self.hubtel_breakers),
+                name="transaction-hubtel-breakers",
+            ),
         ]
         return custom_urls + urls
 
@@ -72,7 +161,9 @@ class TransactionAdmin(admin.ModelAdmin):
     recheck_button.allow_tags = True
 
     def recheck_status(self, request, transaction_id):
-        tx = Transaction.objects.get(id=transaction_id)
+        tx = Transaction.objects.only("id", "client_reference", "status", "created_at").get(
+            id=transaction_id
+        )
         try:
             pos_sales_id = getattr(settings, "POS_SALES_ID", None)
             if not pos_sales_id:
@@ -81,20 +172,21 @@ class TransactionAdmin(admin.ModelAdmin):
                 )
                 return redirect(f"../../{transaction_id}/change/")
 
-            # Build URL
-            url = f"https://api-txnstatus.hubtel.com/transactions/{pos_sales_id}/status"
-            params = {"clientReference": tx.client_reference}
-
-            response = requests.get(url, params=params, timeout=15)
-            response.raise_for_status()
-            data = response.json()
+            data = check_transaction_status(tx.client_reference)
+            if "error" in data:
+                self.message_user(
+                    request,
+                    f"Error checking status: {data['error']}",
+                    level=messages.ERROR,
+                )
+                return redirect(f"../../{transaction_id}/change/")
 
             # interpret Hubtel response
             status = data.get("data", {}).get("Status") or data.get("status")
             if status:
                 tx.status = status.lower()
-                tx.extra.update({"hubtel_check": data})
-                tx.save()
+                tx.update_row("status")
+                ProviderPayload.record(tx, "hubtel_check", data)
                 self.message_user(
                     request, f"Transaction updated to {status}", level=messages.SUCCESS
                 )
@@ -112,12 +204,193 @@ class TransactionAdmin(admin.ModelAdmin):
 
         return redirect(f"../../{transaction_id}/change/")
 
+    def hubtel_breakers(self, request):
+        """Current state and recent transitions of the Hubtel circuit breakers."""
+        return JsonResponse({"breakers": breaker_states()})
+
 
 @admin.register(RetrievalRequest)
-class RetrievalRequestAdmin(admin.ModelAdmin):
+class RetrievalRequestAdmin(
+    ReplicaReadMixin, DeferredListMixin, IndexedSearchMixin, admin.ModelAdmin
+):
     list_display = ("id", "name", "phone", "status", "matched_transaction", "created_at")
-    readonly_fields = ("created_at",)
+    readonly_fields = ("created_at", "match_name", "match_phone")
     list_filter = ("status",)
     search_fields = ("name", "phone")
+    # nullable, so not joined by default: one query per row otherwise
+    list_select_related = ("matched_transaction",)
+    list_defer = ("notes", "matched_transaction__extra")
+    phone_key_search_fields = ("match_phone",)
+    fulltext_search_fields = ("name",)
+    actions = ("rematch_requests",)
+
+    @admin.action(description="Re-match selected pending / no record requests")
+    def rematch_requests(self, request, queryset):
+        matched = rematch(queryset)
+        self.message_user(
+            request, f"Matched {len(matched)} request(s) to paid transactions.", messages.SUCCESS
+        )
+
+
+@admin.register(CustomerProfile)
+class CustomerProfileAdmin(ReplicaReadMixin, IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ("mobile", "name", "receiver_phone", "purchases", "updated_at")
+    readonly_fields = ("purchases", "updated_at")
+    search_fields = ("mobile", "name")
+    prefix_search_fields = ("name",)
+    phone_search_fields = ("mobile",)
+
+
+@admin.register(FunnelCounter)
+class FunnelCounterAdmin(ReplicaReadMixin, admin.ModelAdmin):
+    """Read-only funnel report built from the hourly counters."""
+
+    FUNNEL_STEPS = (
+        ("main_menu", "Main Menu"),
+        ("quantity", "Quantity"),
+        ("name", "Name"),
+        ("phone", "Phone"),
+        ("confirm", "Confirm"),
+        ("rv_name", "Retrieval Name"),
+        ("rv_phone", "Retrieval Phone"),
+    )
+    OUTCOME_COLUMNS = ("invalid", "cancelled", "timed_out")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        period = "hour" if request.GET.get("period") == "hour" else "day"
+        try:
+            days = max(1, min(int(request.GET.get("days", 7)), 90))
+        except ValueError:
+            days = 7
+        trunc = TruncHour if period == "hour" else TruncDay
+
+        totals = {}
+        rows = (
+            FunnelCounter.objects.filter(bucket__gte=timezone.now() - timedelta(days=days))
+            .annotate(period=trunc("bucket"))
+            .values("period", "step", "outcome")
+            .annotate(total=Sum("count"))
+        )
+        # this view replaces the mixin's changelist_view, so route it here
+        with read_from_replica():
+            for row in rows:
+                key = (row["step"], row["outcome"])
+                totals.setdefault(row["period"], {})[key] = row["total"]
+
+        periods = []
+        for start in sorted(totals, reverse=True):
+            counts = totals[start]
+            steps = []
+            for step, label in self.FUNNEL_STEPS:
+                entered = counts.get((step, "entered"), 0)
+                advanced = counts.get((step, "advanced"), 0)
+                steps.append(
+                    {
+                        "label": label,
+                        "entered": entered,
+                        "advanced": advanced,
+                        "conversion": (100 * advanced / entered) if entered else None,
+                        "outcomes": [counts.get((step, o), 0) for o in self.OUTCOME_COLUMNS],
+                    }
+                )
+            started = counts.get(("main_menu", "entered"), 0)
+            carted = counts.get(("confirm", "add_to_cart"), 0)
+            periods.append(
+                {
+                    "start": start,
+                    "steps": steps,
+                    "add_to_cart": carted,
+                    "overall": (100 * carted / started) if started else None,
+                }
+            )
+
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "USSD funnel",
+            "opts": self.model._meta,
+            "period": period,
+            "days": days,
+            "periods": periods,
+            "outcome_columns": self.OUTCOME_COLUMNS,
+            **(extra_context or {}),
+        }
+        return render(request, "admin/ussd_app/funnel_report.html", context)
+
+
+@admin.register(ProfileCapture)
+class ProfileCaptureAdmin(
+    ReplicaReadMixin, DeferredListMixin, IndexedSearchMixin, admin.ModelAdmin
+):
+    list_display = (
+        "created_at",
+        "endpoint",
+        "step",
+        "session_id",
+        "duration_ms",
+        "trigger",
+        "download_link",
+    )
+    list_filter = ("endpoint", "trigger", "step")
+    search_fields = ("session_id",)
+    prefix_search_fields = ("session_id",)
+    list_defer = ("stacks",)
+    exclude = ("stacks",)
+    readonly_fields = (
+        "created_at",
+        "endpoint",
+        "method",
+        "session_id",
+        "step",
+        "trigger",
+        "duration_ms",
+        "download_link",
+        "heaviest_stacks",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:capture_id>/folded/",
+                self.admin_site.admin_view(self.download_folded),
+                name="profilecapture-folded",
+            ),
+        ] + super().get_urls()
+
+    def download_link(self, obj):
+        return format_html(
+            '<a href="{}">folded stacks</a>',
+            reverse("admin:profilecapture-folded", args=[obj.pk]),
+        )
+
+    download_link.short_description = "Flamegraph input"
+
+    def heaviest_stacks(self, obj):
+        # folded() writes the heaviest stacks first
+        return format_html("<pre>{}</pre>", "\n".join(obj.stacks.splitlines()[:20]))
+
+    heaviest_stacks.short_description = "Heaviest stacks (microseconds)"
+
+    def download_folded(self, request, capture_id):
+        capture = ProfileCapture.objects.get(pk=capture_id)
+        response = HttpResponse(capture.stacks + "\n", content_type="text/plain")
+        response["Content-Disposition"] = (
+            f'attachment; filename="profile-{capture.endpoint}-{capture.pk}.folded"'
+        )
+        return response
+
 
-    
+def worker_memory(request):
+    """RSS, per-endpoint peaks and top allocators of the worker serving this."""
+    return JsonResponse(memory.snapshot())
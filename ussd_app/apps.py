@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UssdAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ussd_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
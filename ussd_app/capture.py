@@ -0,0 +1,190 @@
+"""
+Opt-in traffic capture for the Hubtel endpoints.
+
+With USSD_CAPTURE_DIR set, every request/response pair seen by a view wrapped
+in @captured is queued and written by a background thread to gzip-compressed
+JSON Lines files that rotate after USSD_CAPTURE_MAX_BYTES of (uncompressed)
+records. Captures can be played back with `python manage.py replay_capture`.
+
+Files are named after the writing process, and each worker only prunes its
+own files down to USSD_CAPTURE_KEEP, so it never removes a file another
+worker still has open. Files left by exited workers are kept until removed by
+hand.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+
+log = logging.getLogger("ussd")
+
+FILE_PREFIX = "capture-"
+FILE_SUFFIX = ".jsonl.gz"
+
+
+class CaptureWriter:
+    def __init__(self, directory, max_bytes, keep, queue_size=10000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._file = None
+        self._raw = None
+        self._path = None
+        self._written = 0  # uncompressed bytes in the current file
+        self._seq = 0
+        self._thread = threading.Thread(
+            target=self._run, name="ussd-capture", daemon=True
+        )
+        os.makedirs(directory, exist_ok=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, record):
+        """Queue a record without ever blocking the request thread."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _own_suffix(self):
+        return f"-{os.getpid()}{FILE_SUFFIX}"
+
+    def _open(self):
+        # the sequence number keeps rotations within one second apart
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        self._seq += 1
+        self._path = os.path.join(
+            self.directory, f"{FILE_PREFIX}{stamp}.{self._seq:04d}{self._own_suffix()}"
+        )
+        self._raw = open(self._path, "ab")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        self._written = 0
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+    def _rotate(self):
+        self._close_file()
+        # only this process's files: other workers may still be writing theirs
+        files = sorted(
+            f
+            for f in os.listdir(self.directory)
+            if f.startswith(FILE_PREFIX) and f.endswith(self._own_suffix())
+        )
+        for old in files[: max(len(files) - self.keep + 1, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+        self._open()
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=1)
+            except queue.Empty:
+                if self._file is not None:
+                    self._file.flush()
+                continue
+            if record is None:
+                self._close_file()
+                return
+            try:
+                if self._file is None:
+                    self._rotate()
+                line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+                self._file.write(line)
+                self._written += len(line)
+                if self._written >= self.max_bytes:
+                    self._rotate()
+            except Exception:
+                log.exception("Traffic capture write failed")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = CaptureWriter(
+                    settings.USSD_CAPTURE_DIR,
+                    settings.USSD_CAPTURE_MAX_BYTES,
+                    settings.USSD_CAPTURE_KEEP,
+                )
+    return _writer
+
+
+def captured(endpoint):
+    """Record request and response of a view when capture is enabled."""
+
+    def decorator(view):
+        if not settings.USSD_CAPTURE_DIR:
+            return view  # capture disabled: no wrapper on the hot path
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            ts = time.time()
+            start = time.perf_counter()
+            response = view(request, *args, **kwargs)
+            duration = time.perf_counter() - start
+            get_writer().submit(
+                {
+                    "ts": ts,
+                    "endpoint": endpoint,
+                    "path": request.path,
+                    "request": request.body.decode(errors="replace"),
+                    "status": response.status_code,
+                    "response": response.content.decode(errors="replace"),
+                    "duration_ms": round(duration * 1000, 3),
+                }
+            )
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def read_capture(paths):
+    """Yield records from capture files (or directories of them) in file order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, f)
+                for f in sorted(os.listdir(path))
+                if f.startswith(FILE_PREFIX) and f.endswith(FILE_SUFFIX)
+            )
+        else:
+            files.append(path)
+    for path in files:
+        with gzip.open(path, "rt") as fh:
+            try:
+                for line in fh:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+            except (EOFError, gzip.BadGzipFile):
+                # file still being written or cut off by a killed worker
+                log.warning("Capture file %s is truncated", path)
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger("ussd")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        super().__init__(f"circuit '{breaker.name}' is open")
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker shared by all threads of a worker.
+
+    The breaker trips after `failure_threshold` consecutive failures, where a
+    call slower than `slow_call_seconds` counts as a failure even if it
+    succeeded. While open every call fails fast with CircuitOpenError; after
+    `recovery_seconds` a single probe is let through (half-open) and its
+    result closes or re-opens the circuit.
+
+    Timeouts adapt to the endpoint: an exponentially weighted average of
+    recent latencies times `timeout_multiplier`, clamped to
+    [min_timeout, max_timeout].
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=5,
+        slow_call_seconds=5.0,
+        recovery_seconds=30.0,
+        min_timeout=2.0,
+        max_timeout=15.0,
+        timeout_multiplier=4.0,
+        ewma_alpha=0.2,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.recovery_seconds = recovery_seconds
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.ewma_alpha = ewma_alpha
+
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.latency_ewma = None
+        self.probe_in_flight = False
+        self.total_calls = 0
+        self.total_failures = 0
+        self.short_circuited = 0
+        self.transitions = deque(maxlen=20)
+
+    # --- state handling (callers hold self._lock) ---
+    def _transition(self, new_state, reason):
+        old_state = self.state
+        if old_state == new_state:
+            return
+        self.state = new_state
+        self.transitions.append(
+            {"at": time.time(), "from": old_state, "to": new_state, "reason": reason}
+        )
+        if new_state == self.OPEN:
+            self.opened_at = time.monotonic()
+            log.warning("Circuit %s opened: %s", self.name, reason)
+        else:
+            log.info("Circuit %s %s -> %s: %s", self.name, old_state, new_state, reason)
+
+    def _observe_latency(self, elapsed):
+        if self.latency_ewma is None:
+            self.latency_ewma = elapsed
+        else:
+            a = self.ewma_alpha
+            self.latency_ewma = a * elapsed + (1 - a) * self.latency_ewma
+
+    def current_timeout(self):
+        if self.latency_ewma is None:
+            return self.max_timeout
+        timeout = self.latency_ewma * self.timeout_multiplier
+        return max(self.min_timeout, min(self.max_timeout, timeout))
+
+    # --- public API ---
+    def before_call(self):
+        """Reserve a call slot; returns the timeout to use or raises CircuitOpenError."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_seconds:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(self)
+                self._transition(self.HALF_OPEN, "recovery timeout elapsed")
+            if self.state == self.HALF_OPEN:
+                if self.probe_in_flight:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(self)
+                self.probe_in_flight = True
+            self.total_calls += 1
+            return self.current_timeout()
+
+    def record_success(self, elapsed):
+        with self._lock:
+            self.probe_in_flight = False
+            self._observe_latency(elapsed)
+            if elapsed > self.slow_call_seconds:
+                self._record_failure(f"slow call {elapsed:.2f}s")
+                return
+            self.consecutive_failures = 0
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED, "probe succeeded")
+
+    def record_failure(self, elapsed=None, reason="call failed"):
+        with self._lock:
+            self.probe_in_flight = False
+            if elapsed is not None:
+                self._observe_latency(elapsed)
+            self._record_failure(reason)
+
+    def release_probe(self):
+        """Give back a reserved call slot without recording an outcome."""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def _record_failure(self, reason):
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self._transition(self.OPEN, f"probe failed: {reason}")
+        elif self.consecutive_failures >= self.failure_threshold:
+            self._transition(
+                self.OPEN, f"{self.consecutive_failures} consecutive failures ({reason})"
+            )
+        elif self.state == self.OPEN:
+            self.opened_at = time.monotonic()
+
+    def call(self, func, *args, is_failure=None, **kwargs):
+        """
+        Call func(*args, timeout=<adaptive>, **kwargs) through the breaker.
+
+        `is_failure(result)` may flag a returned value (e.g. an HTTP 5xx
+        response) as a failure without an exception being raised.
+        """
+        timeout = self.before_call()
+        start = time.monotonic()
+        try:
+            result = func(*args, timeout=timeout, **kwargs)
+        except Exception as e:
+            self.record_failure(time.monotonic() - start, reason=type(e).__name__)
+            raise
+        except BaseException:
+            # interrupted (worker timeout, shutdown), not the endpoint's fault;
+            # free the probe slot so the breaker cannot stay half-open forever
+            self.release_probe()
+            raise
+        elapsed = time.monotonic() - start
+        if is_failure is not None and is_failure(result):
+            self.record_failure(elapsed, reason="bad response")
+        else:
+            self.record_success(elapsed)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "latency_ewma_ms": (
+                    round(self.latency_ewma * 1000, 1)
+                    if self.latency_ewma is not None
+                    else None
+                ),
+                "timeout_seconds": round(self.current_timeout(), 2),
+                "total_calls": self.total_calls,
+                "total_failures": self.total_failures,
+                "short_circuited": self.short_circuited,
+                "transitions": list(self.transitions),
+            }
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name, **options):
+    """Return the process-wide breaker for `name`, creating it on first use."""
+    with _registry_lock:
+        breaker = _registry.get(name)
+        if breaker is None:
+            breaker = _registry[name] = CircuitBreaker(name, **options)
+        return breaker
+
+
+def breaker_states():
+    with _registry_lock:
+        breakers = list(_registry.values())
+    return [b.snapshot() for b in breakers]
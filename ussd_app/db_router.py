@@ -0,0 +1,59 @@
+"""
+Database router sending back-office reads to an optional "replica" alias.
+
+Only code running inside `read_from_replica()` reads from the replica: admin
+changelists, reports and reconciliation scans. Everything else, the USSD hot
+path included, and every write always uses "default". The first write inside
+a replica block pins the rest of that block to the primary so it reads its
+own writes.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+REPLICA = "replica"
+PRIMARY = "default"
+
+_state = threading.local()
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def read_from_replica():
+    depth = getattr(_state, "depth", 0)
+    _state.depth = depth + 1
+    if depth == 0:
+        _state.pinned = False
+    try:
+        yield
+    finally:
+        _state.depth = depth
+        if depth == 0:
+            _state.pinned = False
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (
+            getattr(_state, "depth", 0)
+            and not getattr(_state, "pinned", False)
+            and replica_configured()
+        ):
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        if getattr(_state, "depth", 0):
+            _state.pinned = True  # read-your-writes for the rest of the block
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA, None}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
@@ -0,0 +1,150 @@
+"""
+Per-request deadline for the USSD hot path.
+
+Hubtel drops a USSD session when our reply takes more than a few seconds, so
+a slow query or a locked SQLite file must not hold the request open.
+@deadline_bound gives the view USSD_DEADLINE_SECONDS in total:
+
+- before every query the remaining budget is checked, and the database lock
+  wait (SQLite busy_timeout) or statement/lock timeout (PostgreSQL) is set
+  from what is left;
+- once the budget is spent, or the database gives up waiting, the view
+  answers with a ready-made "please try again" release message and the
+  overrun is logged and counted in the funnel as ("interaction", "overrun").
+
+Other database errors (a missing table, a dropped connection) are real
+faults and propagate as usual.
+"""
+
+import json
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.http import JsonResponse
+
+from . import funnel
+
+log = logging.getLogger("ussd")
+
+TRY_AGAIN_RESPONSE = {
+    "Type": "release",
+    "Message": "Service is busy. Please try again in a moment.",
+    "Label": "Try Again",
+    "DataType": "display",
+    "FieldType": "text",
+}
+
+
+# PostgreSQL query_canceled (statement_timeout) and lock_not_available
+# (lock_timeout); SQLite SQLITE_BUSY, SQLITE_LOCKED and SQLITE_INTERRUPT
+PG_TIMEOUT_CODES = {"57014", "55P03"}
+SQLITE_TIMEOUT_CODES = {5, 6, 9}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def is_timeout(error):
+    """True if a database error means the database gave up waiting."""
+    cause = error.__cause__
+    code = getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)
+    if code:
+        return code in PG_TIMEOUT_CODES
+    code = getattr(cause, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in SQLITE_TIMEOUT_CODES  # primary code of extended ones
+    message = str(error)
+    return "database is locked" in message or "database table is locked" in message
+
+
+def _in_failed_transaction():
+    # psycopg's TransactionStatus.INERROR: only ROLLBACK (TO SAVEPOINT) may run
+    info = getattr(connection.connection, "info", None)
+    return getattr(info, "transaction_status", None) == 3
+
+
+def _set_db_timeouts(ms):
+    """Bound how long the next statement may wait on the current connection."""
+    ms = max(int(ms), 1)
+    # straight on the driver connection: not a logged query and not seen by
+    # the execute wrapper that calls this
+    if connection.vendor == "sqlite":
+        connection.connection.execute(f"PRAGMA busy_timeout = {ms}")
+    elif connection.vendor == "postgresql" and not _in_failed_transaction():
+        with connection.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('statement_timeout', %s, false), "
+                "set_config('lock_timeout', %s, false)",
+                [str(ms), str(ms)],
+            )
+
+
+def _reset_db_timeouts():
+    if connection.connection is None:
+        return
+    if connection.vendor == "sqlite":
+        default_ms = settings.DATABASES["default"].get("OPTIONS", {}).get("timeout", 5) * 1000
+        connection.connection.execute(f"PRAGMA busy_timeout = {int(default_ms)}")
+    elif connection.vendor == "postgresql" and not _in_failed_transaction():
+        with connection.connection.cursor() as cursor:
+            cursor.execute("RESET statement_timeout; RESET lock_timeout")
+
+
+def try_again_response(request):
+    try:
+        session_id = json.loads(request.body.decode()).get("SessionId")
+    except Exception:
+        session_id = request.POST.get("SessionId")
+    return JsonResponse({"SessionId": session_id, **TRY_AGAIN_RESPONSE})
+
+
+def deadline_bound(view):
+    """Run a view within USSD_DEADLINE_SECONDS, failing fast with a release reply."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        budget = settings.USSD_DEADLINE_SECONDS
+        start = time.monotonic()
+        deadline = start + budget
+
+        def guard(execute, sql, params, many, context):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{budget}s budget spent before query")
+            _set_db_timeouts(remaining * 1000)
+            return execute(sql, params, many, context)
+
+        try:
+            connection.ensure_connection()
+            with connection.execute_wrapper(guard):
+                response = view(request, *args, **kwargs)
+        except (DeadlineExceeded, OperationalError) as e:
+            if isinstance(e, OperationalError) and not is_timeout(e):
+                raise
+            elapsed = time.monotonic() - start
+            log.warning(
+                "Interaction deadline overrun after %.2fs (budget %.2fs): %s",
+                elapsed,
+                budget,
+                e,
+            )
+            funnel.record("interaction", "overrun")
+            return try_again_response(request)
+        finally:
+            try:
+                _reset_db_timeouts()
+            except Exception:
+                pass
+
+        elapsed = time.monotonic() - start
+        if elapsed > budget:
+            # finished, just late: still send it, but record the overrun
+            log.warning("Interaction took %.2fs (budget %.2fs)", elapsed, budget)
+            funnel.record("interaction", "overrun")
+        return response
+
+    return wrapper
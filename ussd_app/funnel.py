@@ -0,0 +1,118 @@
+"""
+In-memory USSD funnel counters.
+
+`record(step, outcome)` only bumps a counter under a lock. Every
+USSD_FUNNEL_FLUSH_SECONDS the counts are handed to a background thread that
+adds them to the hourly FunnelCounter rows, so the hot path never touches the
+database for analytics.
+
+Gunicorn's worker_exit hook (gunicorn_conf.py) flushes what is left when a
+worker stops. Other processes (runserver, tests) do not flush at exit, so
+counts recorded there since the last flush are dropped.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+log = logging.getLogger("ussd")
+
+STEP_NAMES = {
+    1: "main_menu",
+    2: "quantity",
+    3: "name",
+    4: "phone",
+    5: "confirm",
+    101: "rv_name",
+    102: "rv_phone",
+}
+
+OUTCOMES = (
+    "entered",
+    "advanced",
+    "invalid",
+    "cancelled",
+    "timed_out",
+    "add_to_cart",
+    "returning",  # took the saved-details offer at the main menu
+    "matched",
+    "no_record",
+)
+
+_counts = Counter()
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_flushing = False
+
+
+def step_name(step):
+    return STEP_NAMES.get(step, f"step_{step}")
+
+
+def record(step, outcome):
+    """Count one funnel event for a session step (number or name)."""
+    global _last_flush, _flushing
+    if isinstance(step, int):
+        step = step_name(step)
+    hour = int(time.time() // 3600)
+    now = time.monotonic()
+    with _lock:
+        _counts[(hour, step, outcome)] += 1
+        if _flushing or now - _last_flush < settings.USSD_FUNNEL_FLUSH_SECONDS:
+            return
+        _flushing = True
+        _last_flush = now
+    threading.Thread(target=_flush_in_background, daemon=True).start()
+
+
+def _flush_in_background():
+    global _flushing
+    try:
+        flush()
+    except Exception:
+        log.exception("Funnel counter flush failed")
+    finally:
+        connection.close()
+        _flushing = False
+
+
+def flush():
+    """Add the pending counts to FunnelCounter; returns the number of rows touched."""
+    from .models import FunnelCounter
+
+    with _lock:
+        pending = list(_counts.items())
+        _counts.clear()
+
+    for i, ((hour, step, outcome), n) in enumerate(pending):
+        bucket = datetime.fromtimestamp(hour * 3600, tz=dt_timezone.utc)
+        try:
+            rows = FunnelCounter.objects.filter(bucket=bucket, step=step, outcome=outcome)
+            if rows.update(count=F("count") + n):
+                continue
+            try:
+                with transaction.atomic():
+                    FunnelCounter.objects.create(
+                        bucket=bucket, step=step, outcome=outcome, count=n
+                    )
+            except IntegrityError:
+                # another worker created the row first
+                rows.update(count=F("count") + n)
+        except Exception:
+            # keep what was not written for the next flush
+            with _lock:
+                _counts.update(dict(pending[i:]))
+            raise
+    return len(pending)
+
+
+def reset():
+    """Drop the pending counts without writing them."""
+    with _lock:
+        _counts.clear()
@@ -0,0 +1,95 @@
+"""
+Outbound calls to Hubtel, each endpoint guarded by its own circuit breaker.
+"""
+
+import logging
+import os
+
+from django.conf import settings
+
+from .circuit_breaker import CircuitOpenError, get_breaker
+
+logger = logging.getLogger(__name__)
+
+callback_breaker = get_breaker(
+    "gs-callback.hubtel.com",
+    failure_threshold=settings.HUBTEL_BREAKER_FAILURES,
+    recovery_seconds=settings.HUBTEL_BREAKER_RECOVERY_SECONDS,
+    max_timeout=10.0,
+)
+txn_status_breaker = get_breaker(
+    "api-txnstatus.hubtel.com",
+    failure_threshold=settings.HUBTEL_BREAKER_FAILURES,
+    recovery_seconds=settings.HUBTEL_BREAKER_RECOVERY_SECONDS,
+    max_timeout=15.0,
+)
+
+
+def get_proxies():
+    proxy_url = os.environ.get("QUOTAGUARD_URL")
+    if not proxy_url:
+        return None  # fail gracefully in local dev
+    return {
+        "http": proxy_url,
+        "https": proxy_url,
+    }
+
+
+def _server_error(response):
+    return response.status_code >= 500
+
+
+def post_callback(payload):
+    """
+    POST a service fulfillment result to Hubtel's callback endpoint.
+
+    Raises CircuitOpenError without touching the network while the
+    callback endpoint is considered down.
+    """
+    import requests  # imported lazily, only fulfillment and admin need it
+
+    return callback_breaker.call(
+        requests.post,
+        settings.HUBTEL_CALLBACK_URL,
+        json=payload,
+        headers={"Content-Type": "application/json"},
+        proxies=get_proxies(),
+        is_failure=_server_error,
+    )
+
+
+def check_transaction_status(client_reference):
+    """
+    Returns the JSON response from Hubtel transaction status endpoint.
+    """
+    import requests
+
+    pos_sales_id = settings.POS_SALES_ID
+    url = settings.HUBTEL_TXN_STATUS_URL.format(pos_sales_id=pos_sales_id)
+    params = {"clientReference": client_reference}
+
+    logger.info("INCOMING (STATUS CHECK): %s - Params: %s", url, params)
+
+    try:
+        resp = txn_status_breaker.call(
+            requests.get,
+            url,
+            params=params,
+            proxies=get_proxies(),
+            is_failure=_server_error,
+        )
+
+        try:
+            logger.info("OUTGOING (STATUS CHECK): %s", resp.text)
+        except Exception:
+            logger.info("OUTGOING (STATUS CHECK): <non-text-response>")
+
+        resp.raise_for_status()
+        return resp.json()
+
+    except CircuitOpenError as e:
+        logger.warning("SKIPPED (STATUS CHECK): %s", e)
+        return {"error": str(e)}
+    except Exception as e:
+        logger.error("ERROR (STATUS CHECK): %s", e)
+        return {"error": str(e)}
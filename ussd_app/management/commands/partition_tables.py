@@ -0,0 +1,266 @@
+"""
+Monthly range partitioning of USSDSession and Transaction on PostgreSQL.
+
+    manage.py partition_tables --convert     one-off: turn the plain tables
+                                             into partitioned ones
+    manage.py partition_tables               create the next --ahead months,
+                                             detach months past --keep-months
+
+Run the second form from cron (daily is plenty); it is idempotent.
+
+--convert renames each table to <table>_legacy, creates a partitioned table
+with the same columns under the original name and attaches the legacy table
+as the partition for everything before next month, so no rows are copied.
+PostgreSQL only allows keys on a partitioned table that include the
+partition key, so after conversion:
+
+- the primary key is (id, created_at); ids still come from one sequence;
+- session_id / client_reference can no longer have a unique index. Each
+  one gets a plain lookup index instead, and a trigger that claims every
+  value in a non-partitioned <table>_<column>_claims table whose primary key
+  keeps it unique across all partitions. A duplicate insert fails with the
+  usual unique violation (IntegrityError in Django), also between concurrent
+  transactions, so get_or_create() keeps working;
+- foreign key constraints to and from these tables are dropped. The ORM
+  still joins and cascades on delete (Django cascades in Python), but the
+  database no longer enforces the references.
+
+Detached partitions are left in place as plain tables named
+<table>_pYYYYMM, to be archived or dropped by hand. Their values stay
+claimed, so an old session id or client reference is never reused.
+"""
+
+import re
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ussd_app.models import Transaction, USSDSession
+
+PARTITIONED_MODELS = (USSDSession, Transaction)
+
+_UPPER_BOUND = re.compile(r"TO \('(\d{4})-(\d{2})-(\d{2})")
+_INDEX_DEF = re.compile(r"CREATE INDEX (\S+) ON \S+ (USING .*)")
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Create upcoming monthly partitions of USSDSession and Transaction and "
+        "detach old ones (PostgreSQL only)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert",
+            action="store_true",
+            help="one-off conversion of the plain tables into partitioned tables",
+        )
+        parser.add_argument(
+            "--ahead", type=int, default=3, help="months to create ahead of the current one"
+        )
+        parser.add_argument(
+            "--keep-months",
+            type=int,
+            default=settings.USSD_PARTITION_KEEP_MONTHS,
+            help="detach partitions that ended more than this many months ago (0 keeps all)",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="print the DDL instead of running it"
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError(
+                f"Partitioning needs PostgreSQL, this database is {connection.vendor}"
+            )
+        self.dry_run = options["dry_run"]
+        self.legacy_until = {}
+        this_month = timezone.now().date().replace(day=1)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.cursor = cursor
+            for model in PARTITIONED_MODELS:
+                table = model._meta.db_table
+                partitioned = self._is_partitioned(table)
+                if options["convert"] and not partitioned:
+                    self._convert(model, add_months(this_month, 1))
+                    partitioned = True
+                if not partitioned:
+                    self.stdout.write(f"{table}: not partitioned, run with --convert first")
+                    continue
+                for n in range(options["ahead"] + 1):
+                    self._create_partition(table, add_months(this_month, n))
+                if options["keep_months"]:
+                    self._detach_before(table, add_months(this_month, -options["keep_months"]))
+
+    def _run(self, sql, params=None):
+        if self.dry_run:
+            self.stdout.write(sql if params is None else f"{sql}  -- {params}")
+        else:
+            self.cursor.execute(sql, params)
+
+    def _fetch(self, sql, params):
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def _is_partitioned(self, table):
+        rows = self._fetch("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [table])
+        return rows[0][0] == "p"
+
+    def _convert(self, model, cutover):
+        table = model._meta.db_table
+        legacy = f"{table}_legacy"
+        qn = connection.ops.quote_name
+
+        foreign_keys = self._fetch(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE contype = 'f' AND (confrelid = %s::regclass OR conrelid = %s::regclass)",
+            [table, table],
+        )
+        index_defs = self._fetch(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexdef NOT LIKE 'CREATE UNIQUE%%'",
+            [table],
+        )
+        (primary_key,), = self._fetch(
+            "SELECT conname FROM pg_constraint WHERE contype = 'p' AND conrelid = %s::regclass",
+            [table],
+        )
+        (max_id, sequence, is_identity), = self._fetch(
+            f"SELECT (SELECT max(id) FROM {qn(table)}), "
+            "pg_get_serial_sequence(%s, 'id'), "
+            "(SELECT attidentity <> '' FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = 'id')",
+            [table, table],
+        )
+
+        for relation, name in foreign_keys:
+            self._run(f"ALTER TABLE {relation} DROP CONSTRAINT {qn(name)}")
+        self._run(f"ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}")
+        self._run(
+            f"CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS "
+            "INCLUDING IDENTITY INCLUDING CONSTRAINTS) PARTITION BY RANGE (created_at)"
+        )
+        self._run(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, created_at)")
+        for field in model._meta.local_fields:
+            if field.unique and not field.primary_key:
+                self._claim_unique(table, legacy, field.column)
+        for (indexdef,) in index_defs:
+            match = _INDEX_DEF.match(indexdef)
+            if match:
+                self._run(f"CREATE INDEX {match[1]}_p ON {qn(table)} {match[2]}")
+
+        if is_identity:
+            # the new table has its own identity sequence; carry on from max(id)
+            self._run(f"ALTER TABLE {qn(legacy)} ALTER COLUMN id DROP IDENTITY")
+            if max_id:
+                self._run(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", [table, max_id]
+                )
+        elif sequence:
+            # serial: the copied default still uses the old sequence, keep it alive
+            # when the legacy partition is eventually dropped
+            self._run(f"ALTER SEQUENCE {sequence} OWNED BY {qn(table)}.id")
+
+        # attaching builds the (id, created_at) key on the legacy table
+        self._run(f"ALTER TABLE {qn(legacy)} DROP CONSTRAINT {qn(primary_key)}")
+        self._run(
+            f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(legacy)} "
+            "FOR VALUES FROM (MINVALUE) TO (%s)",
+            [f"{cutover:%Y-%m-%d} 00:00:00+00"],
+        )
+        self.legacy_until[table] = cutover
+        self.stdout.write(
+            f"{table}: converted, existing rows are partition {legacy} "
+            f"(before {cutover:%Y-%m}); dropped {len(foreign_keys)} foreign key(s)"
+        )
+
+    def _claim_unique(self, table, legacy, column):
+        """Keep `column` unique across partitions through a claims table."""
+        qn = connection.ops.quote_name
+        claims = qn(f"{table}_{column}_claims")
+        func = qn(f"{table}_{column}_claim")
+        col = qn(column)
+
+        self._run(f"CREATE INDEX {qn(f'{table}_{column}_idx')} ON {qn(table)} ({col})")
+        self._run(f"CREATE TABLE {claims} (value text PRIMARY KEY)")
+        self._run(
+            f"INSERT INTO {claims} (value) SELECT {col} FROM {qn(legacy)} "
+            f"WHERE {col} IS NOT NULL"
+        )
+        # the insert blocks on a concurrent uncommitted claim of the same
+        # value and fails once that commits, like a unique index would
+        self._run(
+            f"CREATE FUNCTION {func}() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+            "BEGIN\n"
+            f"    IF TG_OP <> 'INSERT' AND OLD.{col} IS NOT NULL\n"
+            f"            AND (TG_OP = 'DELETE' OR NEW.{col} IS DISTINCT FROM OLD.{col}) THEN\n"
+            f"        DELETE FROM {claims} WHERE value = OLD.{col};\n"
+            "    END IF;\n"
+            f"    IF TG_OP <> 'DELETE' AND NEW.{col} IS NOT NULL\n"
+            f"            AND (TG_OP = 'INSERT' OR NEW.{col} IS DISTINCT FROM OLD.{col}) THEN\n"
+            f"        INSERT INTO {claims} (value) VALUES (NEW.{col});\n"
+            "    END IF;\n"
+            "    RETURN NULL;\n"
+            "END $$"
+        )
+        self._run(
+            f"CREATE TRIGGER {func} AFTER INSERT OR UPDATE OF {col} OR DELETE "
+            f"ON {qn(table)} FOR EACH ROW EXECUTE FUNCTION {func}()"
+        )
+
+    def _create_partition(self, table, month):
+        qn = connection.ops.quote_name
+        name = partition_name(table, month)
+        if self._fetch("SELECT to_regclass(%s) IS NOT NULL", [name])[0][0]:
+            return
+        if self._covered(table, month):
+            return  # still inside the legacy partition
+        self._run(
+            f"CREATE TABLE {qn(name)} PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)",
+            [
+                f"{month:%Y-%m-%d} 00:00:00+00",
+                f"{add_months(month, 1):%Y-%m-%d} 00:00:00+00",
+            ],
+        )
+        self.stdout.write(f"{table}: created {name}")
+
+    def _partitions(self, table):
+        """(name, upper bound month) of every attached partition."""
+        rows = self._fetch(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass",
+            [table],
+        )
+        for name, bound in rows:
+            match = _UPPER_BOUND.search(bound or "")
+            if match:
+                yield name, date(int(match[1]), int(match[2]), int(match[3]))
+
+    def _covered(self, table, month):
+        # only the legacy partition can overlap a month without being named after it
+        if month < self.legacy_until.get(table, date.min):
+            return True
+        return any(
+            name.endswith("_legacy") and month < upper
+            for name, upper in self._partitions(table)
+        )
+
+    def _detach_before(self, table, cutoff):
+        qn = connection.ops.quote_name
+        for name, upper in self._partitions(table):
+            if upper <= cutoff:
+                self._run(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+                self.stdout.write(f"{table}: detached {name} (ended {upper:%Y-%m})")
@@ -0,0 +1,254 @@
+import csv
+import json
+import sys
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ussd_app.db_router import read_from_replica
+from ussd_app.models import Transaction
+
+# Hubtel and local statuses folded onto the values Transaction.status uses
+STATUS_MAP = {
+    "paid": "success",
+    "success": "success",
+    "successful": "success",
+    "completed": "success",
+    "failed": "failed",
+    "unpaid": "failed",
+    "cancelled": "failed",
+    "declined": "failed",
+    "pending": "pending",
+}
+APP_STATUSES = frozenset(STATUS_MAP.values())
+# --fix only settles orders, it never reopens one
+FIXABLE_STATUSES = ("success", "failed")
+
+OUTPUT_FIELDS = (
+    "kind",
+    "client_reference",
+    "order_id",
+    "local_amount_cents",
+    "settlement_amount_cents",
+    "local_status",
+    "settlement_status",
+)
+
+
+def normalize_status(value):
+    value = (value or "").strip().lower()
+    return STATUS_MAP.get(value, value)
+
+
+def to_cents(value):
+    if value in (None, ""):
+        return None
+    try:
+        return int((Decimal(str(value).replace(",", "")) * 100).quantize(Decimal(1)))
+    except InvalidOperation:
+        return None
+
+
+def parse_day(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcile a Hubtel settlement export (CSV, JSON or JSON Lines) against "
+        "Transactions with an in-memory hash join and report mismatches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file")
+        parser.add_argument("--format", choices=("csv", "json", "jsonl"))
+        parser.add_argument("--from", dest="date_from", required=True, help="YYYY-MM-DD")
+        parser.add_argument("--to", dest="date_to", required=True, help="YYYY-MM-DD")
+        parser.add_argument("--ref-column", default="ClientReference")
+        parser.add_argument("--order-column", default="OrderId")
+        parser.add_argument("--amount-column", default="Amount")
+        parser.add_argument("--status-column", default="Status")
+        parser.add_argument("--output", help="write mismatches as CSV here (default stdout)")
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help=(
+                "bulk-update local status (to success/failed, never away from "
+                "success) and missing order ids from the settlement"
+            ),
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    # --- input ---
+    def _rows(self, path, fmt):
+        if fmt == "csv":
+            with open(path, newline="", encoding="utf-8-sig") as fh:
+                yield from csv.DictReader(fh)
+        elif fmt == "jsonl":
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+        else:
+            with open(path, encoding="utf-8") as fh:
+                data = json.load(fh)
+            if isinstance(data, dict):
+                data = data.get("data") or data.get("transactions") or []
+            yield from data
+
+    def _load_index(self, date_from, date_to):
+        """
+        One pass over the date range into two dicts:
+        client_reference -> [id, order_id, amount_cents, status] and
+        order_id -> client_reference.
+        """
+        tz = timezone.get_current_timezone()
+        start = timezone.make_aware(datetime.combine(date_from, dt_time.min), tz)
+        end = timezone.make_aware(
+            datetime.combine(date_to + timedelta(days=1), dt_time.min), tz
+        )
+        by_ref = {}
+        by_order = {}
+        rows = (
+            Transaction.objects.filter(created_at__gte=start, created_at__lt=end)
+            .order_by("created_at")
+            .values_list("id", "client_reference", "order_id", "amount_cents", "status")
+            .iterator(chunk_size=5000)
+        )
+        for pk, ref, order_id, amount_cents, status in rows:
+            key = ref or f"#{pk}"
+            by_ref[key] = [pk, order_id, amount_cents, status]
+            if order_id:
+                by_order[order_id] = key
+        return by_ref, by_order
+
+    def handle(self, *args, **options):
+        path = options["file"]
+        fmt = options["format"] or (
+            "csv" if path.endswith(".csv") else "jsonl" if path.endswith(".jsonl") else "json"
+        )
+        date_from = parse_day(options["date_from"])
+        date_to = parse_day(options["date_to"])
+        ref_col = options["ref_column"]
+        order_col = options["order_column"]
+        amount_col = options["amount_column"]
+        status_col = options["status_column"]
+
+        with read_from_replica():
+            by_ref, by_order = self._load_index(date_from, date_to)
+        self.stderr.write(f"Loaded {len(by_ref)} local transactions")
+
+        out_fh = open(options["output"], "w", newline="") if options["output"] else sys.stdout
+        writer = csv.DictWriter(out_fh, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+
+        seen = set()
+        fixes = {}
+        counts = {"rows": 0, "matched": 0}
+
+        def emit(kind, ref, order_id, local, settle_amount, settle_status):
+            counts[kind] = counts.get(kind, 0) + 1
+            writer.writerow(
+                {
+                    "kind": kind,
+                    "client_reference": ref,
+                    "order_id": order_id or (local[1] if local else ""),
+                    "local_amount_cents": local[2] if local else "",
+                    "settlement_amount_cents": "" if settle_amount is None else settle_amount,
+                    "local_status": local[3] if local else "",
+                    "settlement_status": settle_status,
+                }
+            )
+
+        try:
+            for row in self._rows(path, fmt):
+                counts["rows"] += 1
+                ref = (row.get(ref_col) or "").strip()
+                order_id = str(row.get(order_col) or "").strip()
+                amount = to_cents(row.get(amount_col))
+                settle_status = normalize_status(row.get(status_col))
+
+                key = by_order.get(order_id) if order_id else None
+                if key is None and ref in by_ref:
+                    key = ref
+                local = by_ref.get(key) if key else None
+                if local is None:
+                    emit("missing_local", ref, order_id, None, amount, settle_status)
+                    continue
+
+                seen.add(key)
+                ok = True
+                if amount is not None and amount != local[2]:
+                    emit("amount_differs", key, order_id, local, amount, settle_status)
+                    ok = False
+                if settle_status and settle_status not in APP_STATUSES:
+                    # e.g. "refunded": no local equivalent, leave it to a person
+                    emit("unknown_status", key, order_id, local, amount, settle_status)
+                    ok = False
+                elif settle_status and settle_status != normalize_status(local[3]):
+                    emit("status_differs", key, order_id, local, amount, settle_status)
+                    if settle_status in FIXABLE_STATUSES and local[3] != "success":
+                        # only fill in order ids we don't have yet
+                        fixes[local[0]] = (
+                            settle_status,
+                            None if local[1] else order_id or None,
+                        )
+                    ok = False
+                if ok:
+                    counts["matched"] += 1
+
+            for key, local in by_ref.items():
+                if key not in seen and normalize_status(local[3]) == "success":
+                    emit("missing_settlement", key, None, local, None, "")
+        finally:
+            if out_fh is not sys.stdout:
+                out_fh.close()
+
+        if options["fix"] and fixes:
+            self._apply_fixes(fixes, options["batch_size"])
+
+        self.stderr.write(
+            ", ".join(f"{kind}: {count}" for kind, count in counts.items())
+        )
+
+    def _apply_fixes(self, fixes, batch_size):
+        """
+        Set-based corrections in one transaction: one UPDATE per status and
+        batch of ids, after filling in the order ids the rows were missing.
+        Rows that became successful since the index was loaded (a late
+        fulfillment) are left alone, and an order id is never overwritten.
+        """
+        now = timezone.now()
+        by_status = {}
+        order_ids = {}
+        for pk, (status, order_id) in fixes.items():
+            by_status.setdefault(status, []).append(pk)
+            if order_id:
+                order_ids[pk] = order_id
+
+        updated = filled = 0
+        with transaction.atomic():
+            # before the status updates, which would make the rows "success"
+            for pk, order_id in order_ids.items():
+                filled += (
+                    Transaction.objects.filter(pk=pk, order_id__isnull=True)
+                    .exclude(status="success")
+                    .update(order_id=order_id)
+                )
+            for status, ids in by_status.items():
+                for i in range(0, len(ids), batch_size):
+                    updated += (
+                        Transaction.objects.filter(pk__in=ids[i : i + batch_size])
+                        .exclude(status="success")
+                        .update(status=status, updated_at=now)
+                    )
+        self.stderr.write(
+            f"Updated {updated} transactions ({filled} order ids filled in)"
+        )
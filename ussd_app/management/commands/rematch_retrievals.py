@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ussd_app.retrieval import rematch
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-match pending and no_record voucher retrieval requests against paid "
+        "transactions in one set-based pass"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="report matches without saving them"
+        )
+
+    def handle(self, *args, **options):
+        matched = rematch(batch_size=options["batch_size"], dry_run=options["dry_run"])
+        for rr in matched[:20] if options["verbosity"] > 1 else ():
+            self.stdout.write(f"request {rr.pk} -> transaction {rr.matched_transaction_id}")
+        verb = "would match" if options["dry_run"] else "matched"
+        self.stdout.write(f"{verb} {len(matched)} request(s)")
@@ -0,0 +1,189 @@
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ussd_app.capture import read_capture
+
+
+def _session_key(record):
+    try:
+        payload = json.loads(record["request"])
+    except ValueError:
+        return None, None
+    return payload.get("SessionId") or payload.get("sessionId"), payload
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round((len(values) - 1) * pct / 100)))]
+
+
+def _comparable(body):
+    """Response body with the (possibly rewritten) SessionId left out."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+    if isinstance(data, dict):
+        data.pop("SessionId", None)
+    return data
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay captured interaction/fulfillment traffic against a running "
+        "instance, keeping per-session ordering, and compare latencies"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="capture files or directories")
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=1.0,
+            help="time acceleration, e.g. 10 for 10x; 0 replays as fast as possible",
+        )
+        parser.add_argument("--endpoint", choices=("interaction", "fulfillment"))
+        parser.add_argument(
+            "--concurrency", type=int, default=50, help="sessions replayed in parallel"
+        )
+        parser.add_argument(
+            "--session-suffix",
+            default="",
+            help="appended to every SessionId so a capture can be replayed twice",
+        )
+        parser.add_argument("--timeout", type=float, default=30)
+
+    def handle(self, *args, **options):
+        speed = options["speed"]
+        suffix = options["session_suffix"]
+        base_url = options["base_url"].rstrip("/")
+
+        sessions = defaultdict(list)
+        for record in read_capture(options["paths"]):
+            if options["endpoint"] and record["endpoint"] != options["endpoint"]:
+                continue
+            session_id, payload = _session_key(record)
+            if payload is not None and suffix and session_id:
+                payload["SessionId"] = f"{session_id}{suffix}"
+                record["request"] = json.dumps(payload)
+            sessions[session_id].append(record)
+        if not sessions:
+            raise CommandError("No records found in capture")
+        for records in sessions.values():
+            records.sort(key=lambda r: r["ts"])
+
+        t0 = min(records[0]["ts"] for records in sessions.values())
+        results = []
+        results_lock = threading.Lock()
+        start = time.monotonic()
+
+        def replay_session(records):
+            for record in records:
+                if speed > 0:
+                    due = start + (record["ts"] - t0) / speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                result = self._send(base_url, record, options["timeout"])
+                with results_lock:
+                    results.append((record, result))
+
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            for future in [pool.submit(replay_session, r) for r in sessions.values()]:
+                future.result()
+
+        self._report(results, time.monotonic() - start, len(sessions))
+
+    def _send(self, base_url, record, timeout):
+        req = urllib.request.Request(
+            base_url + record["path"],
+            data=record["request"].encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        begin = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                status, body = resp.status, resp.read().decode(errors="replace")
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read().decode(errors="replace")
+        except Exception as e:
+            status, body = None, str(e)
+        return {
+            "status": status,
+            "response": body,
+            "duration_ms": (time.perf_counter() - begin) * 1000,
+        }
+
+    def _report(self, results, wall, session_count):
+        # requests that got no response at all have no meaningful latency
+        failed = [(r, res) for r, res in results if res["status"] is None]
+        answered = [(r, res) for r, res in results if res["status"] is not None]
+        by_endpoint = defaultdict(list)
+        for record, result in results:
+            by_endpoint[record["endpoint"]].append((record, result))
+
+        self.stdout.write(
+            f"Replayed {len(results)} requests from {session_count} sessions "
+            f"in {wall:.1f}s"
+        )
+        self.stdout.write(
+            f"{'endpoint':<12}{'count':>7}{'errors':>8}{'orig p50':>10}{'new p50':>10}"
+            f"{'orig p95':>10}{'new p95':>10}{'orig p99':>10}{'new p99':>10}"
+            f"{'status diff':>13}{'body diff':>11}"
+        )
+        for endpoint, pairs in sorted(by_endpoint.items()):
+            ok = [(r, res) for r, res in pairs if res["status"] is not None]
+            orig = [r["duration_ms"] for r, _ in ok]
+            new = [res["duration_ms"] for _, res in ok]
+            status_diff = sum(1 for r, res in ok if r["status"] != res["status"])
+            body_diff = sum(
+                1
+                for r, res in ok
+                if _comparable(r["response"]) != _comparable(res["response"])
+            )
+            self.stdout.write(
+                f"{endpoint:<12}{len(pairs):>7}{len(pairs) - len(ok):>8}"
+                f"{_percentile(orig, 50):>10.1f}{_percentile(new, 50):>10.1f}"
+                f"{_percentile(orig, 95):>10.1f}{_percentile(new, 95):>10.1f}"
+                f"{_percentile(orig, 99):>10.1f}{_percentile(new, 99):>10.1f}"
+                f"{status_diff:>13}{body_diff:>11}"
+            )
+
+        deltas = sorted(
+            answered,
+            key=lambda pair: pair[1]["duration_ms"] - pair[0]["duration_ms"],
+            reverse=True,
+        )[:5]
+        if deltas:
+            self.stdout.write("Largest slowdowns (ms, original -> replay):")
+            for record, result in deltas:
+                session_id, _ = _session_key(record)
+                self.stdout.write(
+                    f"  {record['endpoint']} {session_id}: "
+                    f"{record['duration_ms']:.1f} -> {result['duration_ms']:.1f}"
+                )
+        if answered:
+            mean_delta = statistics.mean(
+                res["duration_ms"] - r["duration_ms"] for r, res in answered
+            )
+            self.stdout.write(f"Mean latency change: {mean_delta:+.1f} ms")
+
+        if failed:
+            errors = defaultdict(int)
+            for _, result in failed:
+                errors[result["response"]] += 1
+            self.stdout.write(f"Failed requests (no response): {len(failed)}")
+            for error, count in sorted(errors.items(), key=lambda e: -e[1])[:5]:
+                self.stdout.write(f"  {count} x {error}")
+            raise CommandError(f"{len(failed)} of {len(results)} requests got no response")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ussd_app.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Prime the price cache and URL resolver"
+
+    def handle(self, *args, **options):
+        timings = warm_up()
+        for phase, ms in timings.items():
+            self.stdout.write(f"{phase}: {ms:.2f} ms")
@@ -0,0 +1,140 @@
+"""
+Worker memory telemetry and leak guard.
+
+MemoryTelemetryMiddleware reads the worker's RSS around every request and
+keeps, per endpoint, the request count, the largest RSS growth seen in one
+request and the largest RSS afterwards. With USSD_TRACEMALLOC_FRAMES > 0 it
+also starts tracemalloc and records each endpoint's peak Python allocation,
+and snapshot() lists the top allocating source lines. tracemalloc's peak is
+process-wide, so with threaded workers a peak can include a concurrent
+request.
+
+Leak guard: once RSS is over USSD_MEMORY_BUDGET_MB, over_budget() turns true
+and gunicorn's post_request hook (gunicorn_conf.py) stops the worker after
+the request it just served; the master starts a fresh one, so the worker
+recycles gracefully instead of being OOM-killed mid-session. uvicorn workers
+never call post_request, so for them post_worker_init starts a thread that
+polls over_budget() and sends the worker SIGTERM, which uvicorn handles as a
+graceful shutdown.
+
+Figures are per process: each call to the admin view reports the worker
+that served it. RSS is read from /proc, else from getrusage(); on platforms
+with neither (Windows) it reads as 0 and the leak guard never fires.
+"""
+
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log = logging.getLogger("ussd")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return peak_rss_bytes() or 0  # no /proc: the high-water mark is the best we have
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+def over_budget():
+    budget_mb = settings.USSD_MEMORY_BUDGET_MB
+    return bool(budget_mb) and rss_bytes() > budget_mb * 1024 * 1024
+
+
+def record(endpoint, rss_before, rss_after, peak_alloc=None):
+    with _lock:
+        entry = _stats.setdefault(
+            endpoint,
+            {"requests": 0, "max_rss_growth": 0, "max_rss": 0, "max_peak_alloc": None},
+        )
+        entry["requests"] += 1
+        entry["max_rss_growth"] = max(entry["max_rss_growth"], rss_after - rss_before)
+        entry["max_rss"] = max(entry["max_rss"], rss_after)
+        if peak_alloc is not None:
+            entry["max_peak_alloc"] = max(entry["max_peak_alloc"] or 0, peak_alloc)
+
+
+def snapshot(limit=15):
+    """This worker's memory figures, plus top allocators when tracemalloc is on."""
+    with _lock:
+        endpoints = {name: dict(entry) for name, entry in _stats.items()}
+    data = {
+        "pid": os.getpid(),
+        "rss": rss_bytes(),
+        "peak_rss": peak_rss_bytes(),
+        "budget": settings.USSD_MEMORY_BUDGET_MB * 1024 * 1024 or None,
+        "endpoints": endpoints,
+        "top_allocators": None,
+    }
+    if tracemalloc.is_tracing():
+        stats = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+        data["top_allocators"] = [
+            {"where": str(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in stats
+        ]
+    return data
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+class MemoryTelemetryMiddleware:
+    def __init__(self, get_response):
+        if not settings.USSD_MEMORY_TELEMETRY:
+            raise MiddlewareNotUsed
+        frames = settings.USSD_TRACEMALLOC_FRAMES
+        if frames and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.get_response = get_response
+        self._warned = False
+
+    def __call__(self, request):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        before = rss_bytes()
+        response = self.get_response(request)
+        after = rss_bytes()
+
+        match = getattr(request, "resolver_match", None)
+        endpoint = match.view_name if match else "unresolved"
+        peak_alloc = tracemalloc.get_traced_memory()[1] if tracing else None
+        record(endpoint, before, after, peak_alloc)
+
+        budget_mb = settings.USSD_MEMORY_BUDGET_MB
+        if budget_mb and after > budget_mb * 1024 * 1024 and not self._warned:
+            self._warned = True
+            log.warning(
+                "Worker %s RSS %.0f MB is over the %s MB budget after %s; recycling",
+                os.getpid(),
+                after / 1024 / 1024,
+                budget_mb,
+                endpoint,
+            )
+        return response
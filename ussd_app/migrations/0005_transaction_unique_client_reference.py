@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:55
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def detach_duplicate_references(apps, schema_editor):
+    """
+    Keep client_reference on the newest transaction of each session (the one
+    fulfillment used to pick) and move it into `extra` on the older copies.
+    """
+    Transaction = apps.get_model("ussd_app", "Transaction")
+    duplicated = (
+        Transaction.objects.exclude(client_reference=None)
+        .values("client_reference")
+        .annotate(n=Count("id"))
+        .filter(n__gt=1)
+        .values_list("client_reference", flat=True)
+    )
+    for ref in list(duplicated):
+        older = Transaction.objects.filter(client_reference=ref).order_by("-created_at", "-id")[1:]
+        for tx in older:
+            tx.extra = dict(tx.extra or {}, duplicate_client_reference=ref)
+            tx.client_reference = None
+            tx.save(update_fields=["extra", "client_reference"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ussd_app', '0004_retrievalrequest'),
+    ]
+
+    operations = [
+        migrations.RunPython(detach_duplicate_references, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transaction',
+            name='client_reference',
+            field=models.CharField(blank=True, max_length=128, null=True, unique=True),
+        ),
+    ]
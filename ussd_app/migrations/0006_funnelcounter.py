@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ussd_app', '0005_transaction_unique_client_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FunnelCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('step', models.CharField(max_length=32)),
+                ('outcome', models.CharField(max_length=32)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-bucket',),
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'step', 'outcome'), name='funnel_bucket_step_outcome')],
+            },
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:59
+
+import django.db.models.functions.text
+import ussd_app.search
+from django.db import migrations, models
+
+FTS_TABLE = "ussd_app_retrievalrequest_fts"
+PG_INDEX = "ussd_app_retrievalrequest_name_fts"
+
+
+def create_name_search_index(apps, schema_editor):
+    """Full-text index on RetrievalRequest.name for the active backend."""
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        statements = [
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "name, content='ussd_app_retrievalrequest', content_rowid='id')",
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON ussd_app_retrievalrequest BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name); END",
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON ussd_app_retrievalrequest BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name); END",
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name ON ussd_app_retrievalrequest BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name); "
+            f"INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name); END",
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+        ]
+    elif vendor == "postgresql":
+        statements = [
+            f"CREATE INDEX {PG_INDEX} ON ussd_app_retrievalrequest "
+            "USING gin (to_tsvector('simple', name))"
+        ]
+    else:
+        return  # search falls back to icontains
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_name_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ussd_app', '0006_funnelcounter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='retrievalrequest',
+            name='phone',
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='order_id',
+            field=models.CharField(blank=True, db_index=True, max_length=128, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ussdsession',
+            name='mobile',
+            field=models.CharField(db_index=True, max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=ussd_app.search.PrefixSearchIndex(django.db.models.functions.text.Lower('client_reference'), name='tx_client_ref_prefix_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=ussd_app.search.PrefixSearchIndex(django.db.models.functions.text.Lower('order_id'), name='tx_order_id_prefix_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ussdsession',
+            index=ussd_app.search.PrefixSearchIndex(django.db.models.functions.text.Lower('session_id'), name='session_id_prefix_idx'),
+        ),
+        migrations.RunPython(create_name_search_index, drop_name_search_index),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:03
+
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Q, Subquery
+
+PAYLOAD_KEYS = ("order_info", "hubtel_check")
+
+
+def move_payloads_out_of_extra(apps, schema_editor):
+    """Copy order_info / hubtel_check out of Transaction.extra into ProviderPayload rows."""
+    Transaction = apps.get_model("ussd_app", "Transaction")
+    ProviderPayload = apps.get_model("ussd_app", "ProviderPayload")
+    has_payload = Q()
+    for key in PAYLOAD_KEYS:
+        has_payload |= Q(extra__has_key=key)
+
+    while True:
+        batch = list(
+            Transaction.objects.filter(has_payload).only("id", "extra", "updated_at")[:500]
+        )
+        if not batch:
+            break
+        payloads = []
+        for tx in batch:
+            for key in PAYLOAD_KEYS:
+                if key in tx.extra:
+                    raw = json.dumps(tx.extra.pop(key), separators=(",", ":")).encode()
+                    payloads.append(
+                        ProviderPayload(transaction=tx, kind=key, data=zlib.compress(raw))
+                    )
+        ProviderPayload.objects.bulk_create(payloads)
+        Transaction.objects.bulk_update(batch, ["extra"])
+        # keep the original time on the copies rather than the migration time
+        ProviderPayload.objects.filter(transaction__in=batch).update(
+            created_at=Subquery(
+                Transaction.objects.filter(pk=OuterRef("transaction_id")).values("updated_at")
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ussd_app', '0007_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderPayload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payloads', to='ussd_app.transaction')),
+            ],
+            options={
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.RunPython(move_payloads_out_of_extra, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:09
+
+import django.db.models.functions.text
+import ussd_app.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ussd_app', '0008_providerpayload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileCapture',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('endpoint', models.CharField(max_length=128)),
+                ('method', models.CharField(max_length=8)),
+                ('session_id', models.CharField(blank=True, db_index=True, max_length=128)),
+                ('step', models.IntegerField(blank=True, null=True)),
+                ('trigger', models.CharField(max_length=16)),
+                ('duration_ms', models.FloatField()),
+                ('stacks', models.TextField()),
+            ],
+            options={
+                'ordering': ('-created_at',),
+                'indexes': [ussd_app.search.PrefixSearchIndex(django.db.models.functions.text.Lower('session_id'), name='capture_session_prefix_idx')],
+            },
+        ),
+    ]
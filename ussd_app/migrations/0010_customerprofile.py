@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:14
+
+import django.db.models.functions.text
+import ussd_app.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ussd_app', '0009_profilecapture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mobile', models.CharField(max_length=32, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('receiver_phone', models.CharField(max_length=64)),
+                ('purchases', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [ussd_app.search.PrefixSearchIndex(django.db.models.functions.text.Lower('name'), name='profile_name_prefix_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:18
+
+import re
+
+from django.db import migrations, models
+
+FTS_TABLE = "ussd_app_retrievalrequest_fts"
+BATCH = 1000
+
+
+# frozen copies of ussd_app.search.name_key / phone_key / transaction_match_keys
+def name_key(value):
+    return " ".join(str(value or "").lower().split())
+
+
+def phone_key(value):
+    return re.sub(r"\D", "", str(value or ""))[-9:]
+
+
+def transaction_match_keys(data, tx_mobile=None, session_mobile=None):
+    data = data or {}
+    return {
+        "match_name": name_key(data.get("name")),
+        "match_phone": phone_key(data.get("receiver_phone") or tx_mobile or session_mobile),
+    }
+
+
+def restore_fts_triggers(apps, schema_editor):
+    """
+    SQLite adds the new columns by rebuilding ussd_app_retrievalrequest, which
+    drops the triggers that keep the 0007 full-text index in sync. Row ids
+    are kept, so the index itself is still valid.
+    """
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in (
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+        f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON ussd_app_retrievalrequest BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name); END",
+        f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON ussd_app_retrievalrequest BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name); END",
+        f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name ON ussd_app_retrievalrequest BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name); "
+        f"INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name); END",
+    ):
+        schema_editor.execute(sql)
+
+
+def _in_batches(queryset):
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by("pk")[:BATCH])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def backfill_match_keys(apps, schema_editor):
+    Transaction = apps.get_model("ussd_app", "Transaction")
+    RetrievalRequest = apps.get_model("ussd_app", "RetrievalRequest")
+
+    transactions = Transaction.objects.select_related("session").only(
+        "id", "mobile", "session__mobile", "session__data"
+    )
+    for batch in _in_batches(transactions):
+        for tx in batch:
+            keys = transaction_match_keys(tx.session.data, tx.mobile, tx.session.mobile)
+            tx.match_name, tx.match_phone = keys["match_name"], keys["match_phone"]
+        Transaction.objects.bulk_update(batch, ["match_name", "match_phone"])
+
+    for batch in _in_batches(RetrievalRequest.objects.only("id", "name", "phone")):
+        for rr in batch:
+            rr.match_name = name_key(rr.name)
+            rr.match_phone = phone_key(rr.phone)
+        RetrievalRequest.objects.bulk_update(batch, ["match_name", "match_phone"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ussd_app', '0010_customerprofile'),
+    ]
+
+    operations = [
+        # on unapply the columns are dropped by another table rebuild
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.AddField(
+            model_name='retrievalrequest',
+            name='match_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='retrievalrequest',
+            name='match_phone',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='match_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='match_phone',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='retrievalrequest',
+            index=models.Index(fields=['match_name', 'match_phone'], name='rr_match_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['match_name', 'match_phone'], name='tx_match_key_idx'),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+        migrations.RunPython(backfill_match_keys, migrations.RunPython.noop),
+    ]
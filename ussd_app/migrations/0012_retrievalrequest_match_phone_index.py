@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-19 18:01
+
+import ussd_app.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ussd_app", "0011_match_keys"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="retrievalrequest",
+            index=ussd_app.search.PrefixSearchIndex(
+                models.F("match_phone"), name="rr_match_phone_prefix_idx"
+            ),
+        ),
+    ]
@@ -1,4 +1,77 @@
-from django.db import models
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .search import PrefixSearchIndex, name_key, normalize_msisdn, phone_key
+
+
+class RecentQuerySet(models.QuerySet):
+    def recent(self):
+        """
+        Rows created within USSD_HOT_WINDOW_DAYS. Hot-path lookups try this
+        first so a created_at bound lets PostgreSQL prune old partitions, and
+        fall back to all rows on a miss: an older row is rare but valid.
+        """
+        since = timezone.now() - timedelta(days=settings.USSD_HOT_WINDOW_DAYS)
+        return self.filter(created_at__gte=since)
+
+    def get_or_create_recent(self, defaults=None, **lookup):
+        """
+        get_or_create() for a globally unique `lookup` that searches only the
+        hot window before creating. A row outside the window (or a concurrent
+        create) shows up as an IntegrityError on insert, and is then read
+        without the bound.
+        """
+        try:
+            return self.recent().get(**lookup), False
+        except self.model.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic(using=self.db):
+                return self.create(**lookup, **(defaults or {})), True
+        except IntegrityError:
+            try:
+                return self.get(**lookup), False
+            except self.model.DoesNotExist:
+                pass
+            raise
+
+
+class PartitionedModel(models.Model):
+    """
+    Base of the tables partition_tables splits by month of created_at. Once
+    they are partitioned the primary key is (id, created_at), so writes to a
+    loaded row go through update_row(): filtering on both columns sends
+    PostgreSQL straight to the row's partition instead of probing them all.
+    """
+
+    objects = RecentQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def update_row(self, *fields):
+        """
+        Write `fields` of this row (default: every column but the id,
+        created_at and the unique key) and refresh updated_at.
+        """
+        if not fields:
+            fields = [
+                f.attname
+                for f in self._meta.concrete_fields
+                if not (f.primary_key or f.unique or f.name == "created_at")
+            ]
+        self.updated_at = timezone.now()
+        values = {name: getattr(self, name) for name in {*fields, "updated_at"}}
+        type(self)._base_manager.filter(pk=self.pk, created_at=self.created_at).update(
+            **values
+        )
 
 
 # Create your models here.
@@ -14,9 +87,9 @@ class Price(models.Model):
         return f"{self.item_code} @ {self.price_ghs():.2f} GHS"
 
 
-class USSDSession(models.Model):
+class USSDSession(PartitionedModel):
     session_id = models.CharField(max_length=128, unique=True)
-    mobile = models.CharField(max_length=32)
+    mobile = models.CharField(max_length=32, db_index=True)
     sequence = models.IntegerField(default=1)
     client_state = models.CharField(max_length=256, blank=True, null=True)
     step = models.IntegerField(default=0)
@@ -26,27 +99,47 @@ class USSDSession(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            PrefixSearchIndex(Lower("session_id"), name="session_id_prefix_idx"),
+        ]
+
     def __str__(self):
         return f"{self.session_id} ({self.mobile}) step={self.step}"
 
 
-class Transaction(models.Model):
+class Transaction(PartitionedModel):
     session = models.ForeignKey(
         USSDSession, on_delete=models.CASCADE, related_name="transactions"
     )
-    order_id = models.CharField(max_length=128, blank=True, null=True)  # Hubtel OrderId
+    order_id = models.CharField(
+        max_length=128, blank=True, null=True, db_index=True
+    )  # Hubtel OrderId
     client_reference = models.CharField(
-        max_length=128, blank=True, null=True
-    )  # use SessionId as clientReference
+        max_length=128, blank=True, null=True, unique=True
+    )  # use SessionId as clientReference, one transaction per session
     amount_cents = models.IntegerField()
     status = models.CharField(
         max_length=32, default="pending"
     )  # pending/success/failed
     mobile = models.CharField()
-    extra = models.JSONField(default=dict, blank=True)  # store response payloads
+    extra = models.JSONField(
+        default=dict, blank=True
+    )  # small app fields only; raw Hubtel responses live in ProviderPayload
+    # buyer name / receiver phone from the session, normalized with
+    # search.name_key / search.phone_key so retrievals can join on them
+    match_name = models.CharField(max_length=255, blank=True, default="")
+    match_phone = models.CharField(max_length=16, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=("match_name", "match_phone"), name="tx_match_key_idx"),
+            PrefixSearchIndex(Lower("client_reference"), name="tx_client_ref_prefix_idx"),
+            PrefixSearchIndex(Lower("order_id"), name="tx_order_id_prefix_idx"),
+        ]
+
     def amount_ghs(self):
         return self.amount_cents / 100
 
@@ -54,6 +147,73 @@ class Transaction(models.Model):
         return f"TX {self.id} {self.status} {self.amount_ghs():.2f} GHS"
 
 
+class ProviderPayload(models.Model):
+    """
+    Raw Hubtel payload for a transaction (OrderInfo from fulfillment, status
+    check responses), stored zlib-compressed and never updated, so the hot
+    Transaction row stays small.
+    """
+
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, related_name="payloads"
+    )
+    kind = models.CharField(max_length=32)  # order_info / hubtel_check
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("-created_at",)
+
+    @classmethod
+    def record(cls, transaction, kind, payload):
+        raw = json.dumps(payload, separators=(",", ":")).encode()
+        return cls.objects.create(
+            transaction=transaction, kind=kind, data=zlib.compress(raw)
+        )
+
+    def payload(self):
+        return json.loads(zlib.decompress(bytes(self.data)))
+
+    def __str__(self):
+        return f"{self.kind} for TX {self.transaction_id}"
+
+
+class CustomerProfile(models.Model):
+    """
+    Details of a payer's last successful purchase, keyed by their normalized
+    Mobile, so a returning customer can skip the name and phone steps.
+    """
+
+    mobile = models.CharField(max_length=32, unique=True)  # 233XXXXXXXXX
+    name = models.CharField(max_length=255)
+    receiver_phone = models.CharField(max_length=64)
+    purchases = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [PrefixSearchIndex(Lower("name"), name="profile_name_prefix_idx")]
+
+    @classmethod
+    def remember(cls, mobile, name, receiver_phone):
+        """Upsert the profile for `mobile` after a successful purchase."""
+        mobile = normalize_msisdn(mobile)
+        if not (mobile and name and receiver_phone):
+            return
+        details = {"name": name, "receiver_phone": receiver_phone}
+        rows = cls.objects.filter(mobile=mobile)
+        if rows.update(purchases=F("purchases") + 1, updated_at=timezone.now(), **details):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(mobile=mobile, purchases=1, **details)
+        except IntegrityError:
+            # a concurrent fulfillment for the same payer created it first
+            rows.update(purchases=F("purchases") + 1, updated_at=timezone.now(), **details)
+
+    def __str__(self):
+        return f"{self.mobile}: {self.name}, {self.receiver_phone}"
+
+
 class RetrievalRequest(models.Model):
     STATUS_CHOICES = (
         ("pending", "Pending"),
@@ -63,20 +223,73 @@ class RetrievalRequest(models.Model):
 
     session = models.ForeignKey(USSDSession, on_delete=models.SET_NULL, null=True, blank=True)
     name = models.CharField(max_length=255)
-    phone = models.CharField(max_length=64)
+    phone = models.CharField(max_length=64, db_index=True)
     matched_transaction = models.ForeignKey(
         Transaction, on_delete=models.SET_NULL, null=True, blank=True
     )
     status = models.CharField(max_length=32, choices=STATUS_CHOICES, default="pending")
     notes = models.JSONField(default=dict, blank=True)
+    # name / phone normalized like Transaction.match_name / match_phone
+    match_name = models.CharField(max_length=255, blank=True, default="")
+    match_phone = models.CharField(max_length=16, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            models.Index(fields=("match_name", "match_phone"), name="rr_match_key_idx"),
+            PrefixSearchIndex(F("match_phone"), name="rr_match_phone_prefix_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.match_name = name_key(self.name)
+        self.match_phone = phone_key(self.phone)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"name", "phone"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "match_name", "match_phone"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"RetrievalRequest {self.id} {self.name} {self.phone} {self.status}"
-    
 
 
-    
+class FunnelCounter(models.Model):
+    """Hourly count of one USSD funnel event, flushed in batches by funnel.py"""
+
+    bucket = models.DateTimeField()  # start of the hour (UTC)
+    step = models.CharField(max_length=32)  # main_menu, quantity, ...
+    outcome = models.CharField(max_length=32)  # entered, advanced, invalid, ...
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("-bucket",)
+        constraints = [
+            models.UniqueConstraint(
+                fields=("bucket", "step", "outcome"), name="funnel_bucket_step_outcome"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.step} {self.outcome}={self.count}"
+
+
+class ProfileCapture(models.Model):
+    """Folded call stacks of one profiled request (see ussd_app/profiling.py)."""
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    endpoint = models.CharField(max_length=128)  # URL name, e.g. interaction
+    method = models.CharField(max_length=8)
+    session_id = models.CharField(max_length=128, blank=True, db_index=True)
+    step = models.IntegerField(null=True, blank=True)  # session step on arrival
+    trigger = models.CharField(max_length=16)  # header / sample
+    duration_ms = models.FloatField()
+    stacks = models.TextField()  # "frame;frame;frame <microseconds>" per line
+
+    class Meta:
+        ordering = ("-created_at",)
+        indexes = [
+            PrefixSearchIndex(Lower("session_id"), name="capture_session_prefix_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.duration_ms:.1f} ms @ {self.created_at:%Y-%m-%d %H:%M:%S}"
@@ -0,0 +1,149 @@
+"""
+On-demand request profiling.
+
+ProfilingMiddleware profiles a request to USSD_PROFILE_PATHS when it carries
+the header `X-USSD-Profile: <USSD_PROFILE_TOKEN>`, or at random with
+probability USSD_PROFILE_SAMPLE_RATE. Each profiled request is stored as a
+ProfileCapture tagged with the endpoint, SessionId and the step the session
+was at. The capture holds folded call stacks, one "a;b;c <microseconds>" line
+per stack, which flamegraph.pl, inferno and speedscope read directly.
+
+With neither setting configured the middleware removes itself at startup
+(MiddlewareNotUsed), so it can stay in MIDDLEWARE at no per-request cost.
+"""
+
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.crypto import constant_time_compare
+
+log = logging.getLogger("ussd")
+
+HEADER = "HTTP_X_USSD_PROFILE"
+
+
+class StackProfiler:
+    """
+    Deterministic profiler (sys.setprofile) that charges wall time to the
+    full call stack, including C functions. Time spent in the profiler itself
+    is left out. Only the thread that calls start() is profiled.
+    """
+
+    def __init__(self):
+        self.stack = []
+        self.totals = Counter()
+        self._last = 0
+        self._previous = None
+
+    def start(self):
+        self._previous = sys.getprofile()
+        self._last = time.perf_counter_ns()
+        sys.setprofile(self._event)
+
+    def stop(self):
+        sys.setprofile(self._previous)
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter_ns()
+        if self.stack:
+            self.totals[tuple(self.stack)] += now - self._last
+        if event == "call":
+            code = frame.f_code
+            name = getattr(code, "co_qualname", code.co_name)
+            module = frame.f_globals.get("__name__", "?")
+            self.stack.append(f"{module}.{name}:{code.co_firstlineno}")
+        elif event == "c_call":
+            module = getattr(arg, "__module__", None) or "builtins"
+            self.stack.append(f"{module}.{getattr(arg, '__qualname__', arg)}")
+        elif self.stack:
+            # return / c_return / c_exception; frames entered before start()
+            # return with an empty stack and are ignored
+            self.stack.pop()
+        self._last = time.perf_counter_ns()
+
+    def folded(self):
+        """Stacks in the collapsed format flamegraph tools take, heaviest first."""
+        lines = []
+        for stack, ns in self.totals.most_common():
+            if ns >= 1000:
+                frames = ";".join(f.replace(";", ",") for f in stack)
+                lines.append(f"{frames} {ns // 1000}")
+        return "\n".join(lines)
+
+
+def session_tags(request):
+    """(SessionId, current step) of a Hubtel JSON request, else ("", None)."""
+    from .models import USSDSession
+
+    try:
+        payload = json.loads(request.body.decode())
+    except (ValueError, UnicodeDecodeError):
+        return "", None
+    session_id = payload.get("SessionId") if isinstance(payload, dict) else None
+    if not session_id:
+        return "", None
+    step = (
+        USSDSession.objects.filter(session_id=session_id)
+        .values_list("step", flat=True)
+        .first()
+    )
+    return str(session_id), step
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.token = settings.USSD_PROFILE_TOKEN
+        self.rate = settings.USSD_PROFILE_SAMPLE_RATE
+        if not self.token and self.rate <= 0:
+            raise MiddlewareNotUsed
+        self.paths = tuple(settings.USSD_PROFILE_PATHS)
+        self.get_response = get_response
+
+    def trigger(self, request):
+        if not request.path.startswith(self.paths):
+            return None
+        header = request.META.get(HEADER)
+        if header and self.token and constant_time_compare(header, self.token):
+            return "header"
+        if self.rate > 0 and random.random() < self.rate:
+            return "sample"
+        return None
+
+    def __call__(self, request):
+        trigger = self.trigger(request)
+        if not trigger:
+            return self.get_response(request)
+
+        # tagged before profiling so the lookup is not part of the capture
+        session_id, step = session_tags(request)
+        profiler = StackProfiler()
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        match = getattr(request, "resolver_match", None)
+        try:
+            from .models import ProfileCapture
+
+            ProfileCapture.objects.create(
+                endpoint=(match.view_name if match else request.path)[:128],
+                method=request.method,
+                session_id=session_id,
+                step=step,
+                trigger=trigger,
+                duration_ms=duration_ms,
+                stacks=profiler.folded(),
+            )
+        except Exception:
+            log.exception("Could not store profile capture for %s", request.path)
+        return response
@@ -0,0 +1,76 @@
+"""
+Voucher retrieval matching.
+
+rematch() re-checks every pending or no_record RetrievalRequest against paid
+Transactions in one set-based pass: a single query joins each request's
+normalized (match_name, match_phone) key to the newest successful
+transaction with the same key, then the matches are written with
+bulk_update. Requests made before a late fulfillment arrived get picked up
+the next time it runs.
+
+Every match, whether made live in step 102 or by rematch(), is announced with
+the voucher_requests_matched signal (requests=[RetrievalRequest, ...]). Hook
+voucher delivery to it; bulk_update sends no post_save.
+"""
+
+import logging
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import RetrievalRequest, Transaction
+
+log = logging.getLogger("ussd")
+
+voucher_requests_matched = Signal()
+
+UNRESOLVED = ("pending", "no_record")
+
+
+def rematch(queryset=None, batch_size=1000, dry_run=False):
+    """
+    Match the unresolved requests in `queryset` (default: all of them) and
+    return the matched RetrievalRequest objects.
+    """
+    if queryset is None:
+        queryset = RetrievalRequest.objects.all()
+    newest_paid = (
+        Transaction.objects.filter(
+            match_name=OuterRef("match_name"),
+            match_phone=OuterRef("match_phone"),
+            status="success",
+        )
+        .order_by("-created_at")
+        .values("pk")[:1]
+    )
+    rows = (
+        queryset.filter(status__in=UNRESOLVED)
+        .exclude(match_name="")
+        .exclude(match_phone="")
+        .annotate(paid_tx=Subquery(newest_paid))
+        .filter(paid_tx__isnull=False)
+        .values_list("pk", "paid_tx", "notes")
+    )
+
+    now = timezone.now().isoformat()
+    matched = [
+        RetrievalRequest(
+            pk=pk,
+            matched_transaction_id=tx_id,
+            status="matched",
+            notes={**(notes or {}), "matched_tx_status": "success", "rematched_at": now},
+        )
+        for pk, tx_id, notes in rows.iterator(chunk_size=batch_size)
+    ]
+    if dry_run or not matched:
+        return matched
+
+    with transaction.atomic():
+        RetrievalRequest.objects.bulk_update(
+            matched, ["matched_transaction", "status", "notes"], batch_size=batch_size
+        )
+    log.info("Re-matched %s voucher retrieval request(s)", len(matched))
+    voucher_requests_matched.send(sender=RetrievalRequest, requests=matched)
+    return matched
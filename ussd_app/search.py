@@ -0,0 +1,188 @@
+"""
+Index-backed admin search.
+
+Django's admin search compiles every field to LIKE '%term%', which scans the
+whole table. IndexedSearchMixin replaces it with lookups that can use an
+index:
+
+    prefix_search_fields    case-insensitive prefix match on LOWER(field),
+                            served by a PrefixSearchIndex
+    phone_search_fields     prefix match of the 0XX / 233XX variants of the
+                            term on the field's own index
+    phone_key_search_fields prefix match of the term's subscriber digits on a
+                            column holding phone_key() values, so numbers
+                            stored with spaces or dashes are found too
+    fulltext_search_fields  SQLite FTS5 table or PostgreSQL GIN index,
+                            created by migration 0007
+
+Prefix matches are a half-open b-tree range on SQLite and LIKE 'term%' on
+PostgreSQL, where a range ending in U+FFFF is not safe under non-C collations
+and pattern indexes (text_pattern_ops, and the varchar_pattern_ops "_like"
+indexes Django adds to indexed CharFields) serve LIKE directly.
+"""
+
+import re
+
+from django.db import connections, models
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Lower
+from django.db.models.lookups import GreaterThanOrEqual, LessThan, StartsWith
+
+_fts_tables = {}
+
+
+def phone_variants(term):
+    digits = re.sub(r"\D", "", term)
+    if not digits:
+        return []
+    variants = {digits}
+    if digits.startswith("0"):
+        variants.add("233" + digits[1:])
+    elif digits.startswith("233"):
+        variants.add("0" + digits[3:])
+    return sorted(variants)
+
+
+def normalize_msisdn(value):
+    """Digits of a Ghana number in 233XXXXXXXXX form ("024..." -> "23324...")."""
+    digits = re.sub(r"\D", "", str(value or ""))
+    if digits.startswith("0"):
+        digits = "233" + digits[1:]
+    return digits
+
+
+def name_key(value):
+    """Case- and whitespace-insensitive form of a name, for exact-match joins."""
+    return " ".join(str(value or "").lower().split())
+
+
+def phone_key(value):
+    """Subscriber part of a phone number (last 9 digits), whatever the prefix."""
+    return re.sub(r"\D", "", str(value or ""))[-9:]
+
+
+def phone_key_prefix(term):
+    """Subscriber digits typed so far, for prefix matching on phone_key() columns."""
+    digits = re.sub(r"\D", "", term)
+    if digits.startswith("0"):
+        digits = digits[1:]
+    elif digits.startswith("233"):
+        digits = digits[3:]
+    return digits[-9:]
+
+
+def transaction_match_keys(data, tx_mobile=None, session_mobile=None):
+    """
+    Transaction.match_name / match_phone for an order whose details are in
+    session `data`: the voucher goes to receiver_phone, else to the number
+    on the transaction, else to the one that dialed.
+    """
+    data = data or {}
+    return {
+        "match_name": name_key(data.get("name")),
+        "match_phone": phone_key(data.get("receiver_phone") or tx_mobile or session_mobile),
+    }
+
+
+class PrefixSearchIndex(models.Index):
+    """
+    Expression index for prefix_q, e.g. PrefixSearchIndex(Lower("order_id")).
+    PostgreSQL builds it with the text_pattern_ops operator class that
+    LIKE 'x%' needs (django.contrib.postgres must be installed for that);
+    other backends get a plain expression index.
+    """
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        index = self
+        if schema_editor.connection.vendor == "postgresql":
+            from django.contrib.postgres.indexes import OpClass
+
+            index = self.clone()
+            index.expressions = tuple(
+                OpClass(expression, name="text_pattern_ops")
+                for expression in self.expressions
+            )
+        return models.Index.create_sql(index, model, schema_editor, using, **kwargs)
+
+
+def prefix_q(field, term, vendor, fold_case=True):
+    """Q matching rows whose `field` starts with `term` (ignoring case by default)."""
+    lhs = Lower(field) if fold_case else F(field)
+    if fold_case:
+        term = term.lower()
+    if vendor == "postgresql":
+        return Q(StartsWith(lhs, term))
+    # on SQLite LIKE skips b-tree indexes, a half-open range uses them
+    return Q(GreaterThanOrEqual(lhs, term)) & Q(LessThan(lhs, term + "\uffff"))
+
+
+def fts_table_name(model):
+    return f"{model._meta.db_table}_fts"
+
+
+def _has_fts_table(connection, table):
+    key = (connection.alias, table)
+    if key not in _fts_tables:
+        with connection.cursor() as cursor:
+            _fts_tables[key] = table in connection.introspection.table_names(cursor)
+    return _fts_tables[key]
+
+
+def fulltext_q(model, field, term, using="default"):
+    """Q matching rows whose `field` contains every word of `term` as a prefix."""
+    words = re.findall(r"\w+", term.lower())
+    if not words:
+        return Q(pk__in=[])
+    connection = connections[using]
+    table = model._meta.db_table
+    column = model._meta.get_field(field).column
+
+    if connection.vendor == "sqlite" and _has_fts_table(connection, fts_table_name(model)):
+        fts = fts_table_name(model)
+        match = " ".join(f'{column}:"{w}"*' for w in words)
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", (match,)))
+
+    if connection.vendor == "postgresql":
+        query = " & ".join(f"{w}:*" for w in words)
+        return Q(
+            pk__in=RawSQL(
+                f"SELECT id FROM {table} "
+                f"WHERE to_tsvector('simple', {column}) @@ to_tsquery('simple', %s)",
+                (query,),
+            )
+        )
+
+    q = Q()
+    for w in words:
+        q &= Q(**{f"{field}__icontains": w})
+    return q
+
+
+class IndexedSearchMixin:
+    prefix_search_fields = ()
+    phone_search_fields = ()
+    phone_key_search_fields = ()
+    fulltext_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+
+        vendor = connections[queryset.db].vendor
+        q = Q()
+        for field in self.prefix_search_fields:
+            q |= prefix_q(field, term, vendor)
+        for field in self.phone_search_fields:
+            for variant in phone_variants(term):
+                q |= prefix_q(field, variant, vendor, fold_case=False)
+        key = phone_key_prefix(term)
+        for field in self.phone_key_search_fields if key else ():
+            q |= prefix_q(field, key, vendor, fold_case=False)
+        for field in self.fulltext_search_fields:
+            q |= fulltext_q(queryset.model, field, term, using=queryset.db)
+        if not q:
+            # e.g. no digits for a phone-only search: nothing can match
+            return queryset.none(), False
+        return queryset.filter(q), False
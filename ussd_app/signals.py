@@ -0,0 +1,11 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Price
+from .views import PRICE_CACHE_KEY
+
+
+@receiver([post_save, post_delete], sender=Price)
+def invalidate_price_cache(sender, **kwargs):
+    cache.delete(PRICE_CACHE_KEY)
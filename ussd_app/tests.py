@@ -1,3 +1,1744 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import (
+    Client,
+    LiveServerTestCase,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import funnel, memory
+from .capture import CaptureWriter, read_capture
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .db_router import ReadReplicaRouter, read_from_replica
+from .deadline import is_timeout
+from .management.commands.partition_tables import add_months, partition_name
+from .models import (
+    CustomerProfile,
+    FunnelCounter,
+    Price,
+    ProfileCapture,
+    RetrievalRequest,
+    Transaction,
+    USSDSession,
+)
+from .profiling import ProfilingMiddleware
+from .retrieval import voucher_requests_matched
+from .search import IndexedSearchMixin, transaction_match_keys
+from .views import PRICE_CACHE_KEY, get_wassce_price_cents
+from .warmup import warm_up
+
+MOBILE = "233240000000"
+
+
+# tests flush funnel counters explicitly instead of from a background thread
+_no_background_flush = override_settings(USSD_FUNNEL_FLUSH_SECONDS=10**9)
+
+
+def setUpModule():
+    # the views log every INCOMING/OUTGOING payload
+    logging.disable(logging.INFO)
+    _no_background_flush.enable()
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+    _no_background_flush.disable()
+
+
+def hop(client, session_id, msg_type="Response", message="", sequence=1):
+    return client.post(
+        "/ussd_app/interaction/",
+        json.dumps(
+            {
+                "SessionId": session_id,
+                "Type": msg_type,
+                "Message": message,
+                "Mobile": MOBILE,
+                "Sequence": sequence,
+                "ClientState": "",
+            }
+        ),
+        content_type="application/json",
+    )
+
+
+def fulfill(client, session_id, status="Paid", order_id="ORD-1"):
+    return client.post(
+        "/ussd_app/fulfillment/",
+        json.dumps(
+            {
+                "SessionId": session_id,
+                "OrderId": order_id,
+                "OrderInfo": {"Status": status},
+            }
+        ),
+        content_type="application/json",
+    )
+
+
+def run_in_threads(target, count):
+    """Run target(i) in `count` threads released at the same moment."""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def worker(i):
+        try:
+            barrier.wait()
+            target(i)
+        except Exception as e:  # surfaced by the caller
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+class FakeHubtel:
+    """Local stand-in for Hubtel's callback and status endpoints."""
+
+    def __init__(self):
+        self.calls = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fake.calls.append((self.path, json.loads(body or b"{}")))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"ok": true}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# --- views ---
+
+
+class PendingTransactionTests(TestCase):
+    def test_repeated_phone_hop_reuses_transaction(self):
+        client = Client()
+        USSDSession.objects.create(
+            session_id="s1", mobile=MOBILE, step=4, data={"qty": 2, "name": "Ama"}
+        )
+        hop(client, "s1", message="0240000000")
+        USSDSession.objects.filter(session_id="s1").update(step=4)
+        hop(client, "s1", message="0240000000")
+
+        self.assertEqual(Transaction.objects.filter(client_reference="s1").count(), 1)
+
+    def test_confirm_after_payment_does_not_reopen_transaction(self):
+        client = Client()
+        session = USSDSession.objects.create(
+            session_id="s2", mobile=MOBILE, step=5, data={"qty": 1}
+        )
+        Transaction.objects.create(
+            session=session, client_reference="s2", amount_cents=2400, status="success"
+        )
+
+        resp = hop(client, "s2", message="1").json()
+
+        self.assertEqual(resp["Type"], "release")
+        self.assertEqual(
+            Transaction.objects.get(client_reference="s2").status, "success"
+        )
+
+
+class ConcurrentHopTests(TransactionTestCase):
+    def test_parallel_phone_hops_create_one_transaction(self):
+        USSDSession.objects.create(
+            session_id="race", mobile=MOBILE, step=4, data={"qty": 1, "name": "Ama"}
+        )
+
+        def phone_hop(i):
+            USSDSession.objects.filter(session_id="race").update(step=4)
+            hop(Client(), "race", message="0240000000")
+
+        errors = run_in_threads(phone_hop, 8)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Transaction.objects.filter(client_reference="race").count(), 1)
+
+    @mock.patch("ussd_app.views.post_callback")
+    def test_parallel_confirm_does_not_undo_fulfillment(self, post_callback):
+        post_callback.return_value = mock.Mock(status_code=200, text="ok")
+        session = USSDSession.objects.create(
+            session_id="lost", mobile=MOBILE, step=5, data={"qty": 1}
+        )
+        Transaction.objects.create(
+            session=session, client_reference="lost", amount_cents=2400
+        )
+
+        def confirm_or_pay(i):
+            if i == 0:
+                fulfill(Client(), "lost")
+            else:
+                hop(Client(), "lost", message="1")
+
+        errors = run_in_threads(confirm_or_pay, 8)
+
+        self.assertEqual(errors, [])
+        tx = Transaction.objects.get(client_reference="lost")
+        self.assertEqual(tx.status, "success")
+        self.assertEqual(tx.order_id, "ORD-1")
+
+
+class LiveServerConcurrencyTests(LiveServerTestCase):
+    """Same-session hops against the real multi-threaded test server."""
+
+    def post(self, session_id, msg_type="Response", message=""):
+        body = json.dumps(
+            {
+                "SessionId": session_id,
+                "Type": msg_type,
+                "Message": message,
+                "Mobile": MOBILE,
+            }
+        ).encode()
+        req = urllib.request.Request(
+            f"{self.live_server_url}/ussd_app/interaction/",
+            data=body,
+            headers={"Content-Type": "application/json"},
+        )
+        start = time.perf_counter()
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            data = json.loads(resp.read())
+        return time.perf_counter() - start, data
+
+    def test_same_session_hops_in_parallel(self):
+        USSDSession.objects.create(
+            session_id="live", mobile=MOBILE, step=4, data={"qty": 1, "name": "Ama"}
+        )
+        latencies = []
+
+        def phone_hop(i):
+            elapsed, data = self.post("live", message="0240000000")
+            latencies.append(elapsed)
+            # hops that arrive after the first one moved the session on are
+            # read as step-5 input; any valid USSD reply is fine here
+            self.assertIn(data["Type"], ("response", "release"))
+
+        errors = run_in_threads(phone_hop, 10)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Transaction.objects.filter(client_reference="live").count(), 1)
+        self.assertLess(max(latencies), 5.0, "same-session hops serialized too long")
+
+    def test_parallel_sessions_complete(self):
+        def purchase(i):
+            sid = f"live-{i}"
+            for msg_type, message in (
+                ("Initiation", ""),
+                ("Response", "1"),
+                ("Response", "1"),
+                ("Response", "Ama Mensah"),
+                ("Response", "0240000000"),
+            ):
+                _, data = self.post(sid, msg_type, message)
+            self.assertEqual(data["Label"], "Confirm Purchase")
+
+        errors = run_in_threads(purchase, 10)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            Transaction.objects.filter(client_reference__startswith="live-").count(), 10
+        )
+
+
+class ReturningCustomerTests(TestCase):
+    @mock.patch("ussd_app.views.post_callback")
+    def test_paid_order_enables_saved_details_offer(self, post_callback):
+        post_callback.return_value = mock.Mock(status_code=200, text="ok")
+        client = Client()
+        USSDSession.objects.create(
+            session_id="first",
+            mobile="0240000000",  # same payer as MOBILE, local format
+            step=4,
+            data={"qty": 1, "name": "Ama Mensah"},
+        )
+        hop(client, "first", message="0209998888")
+        fulfill(client, "first")
+
+        profile = CustomerProfile.objects.get()
+        self.assertEqual(
+            (profile.mobile, profile.name, profile.receiver_phone, profile.purchases),
+            (MOBILE, "Ama Mensah", "0209998888", 1),
+        )
+
+        menu = hop(client, "second", msg_type="Initiation").json()
+        self.assertIn("3. Buy for Ama Mensah, 0209998888", menu["Message"])
+        self.assertEqual(hop(client, "second", message="3").json()["Label"], "Quantity")
+        confirm = hop(client, "second", message="2").json()
+        self.assertEqual(confirm["Label"], "Confirm Purchase")
+        self.assertEqual(
+            USSDSession.objects.get(session_id="second").data["receiver_phone"],
+            "0209998888",
+        )
+
+    def test_new_customer_gets_plain_menu(self):
+        menu = hop(Client(), "new", msg_type="Initiation").json()
+        self.assertNotIn("3. Buy for", menu["Message"])
+        self.assertEqual(hop(Client(), "new", message="3").json()["Type"], "release")
+
+
+class ProviderPayloadTests(TestCase):
+    def test_fulfillment_payload_is_kept_off_the_transaction_row(self):
+        session = USSDSession.objects.create(session_id="p1", mobile=MOBILE, step=5)
+        Transaction.objects.create(
+            session=session, client_reference="p1", amount_cents=2400, extra={"a": 1}
+        )
+
+        with mock.patch("ussd_app.views.post_callback") as post_callback:
+            post_callback.return_value = mock.Mock(status_code=200, text="ok")
+            fulfill(Client(), "p1", order_id="ORD-9")
+
+        tx = Transaction.objects.get(client_reference="p1")
+        self.assertEqual(
+            (tx.status, tx.order_id, tx.extra), ("success", "ORD-9", {"a": 1})
+        )
+        payload = tx.payloads.get()
+        self.assertEqual(payload.kind, "order_info")
+        self.assertEqual(payload.payload(), {"Status": "Paid"})
+        self.assertNotIn(b"Paid", bytes(payload.data))  # stored compressed
+
+    def test_changelists_leave_out_json_of_listed_and_related_rows(self):
+        client = Client()
+        client.force_login(
+            User.objects.create_superuser("admin", "a@example.com", "pw")
+        )
+        session = USSDSession.objects.create(
+            session_id="p1", mobile=MOBILE, data={"a": 1}
+        )
+        tx = Transaction.objects.create(
+            session=session, client_reference="p1", amount_cents=2400, extra={"a": 1}
+        )
+        RetrievalRequest.objects.create(
+            name="Ama", phone="0209998888", matched_transaction=tx
+        )
+
+        for url, deferred in (
+            (
+                "/admin/ussd_app/transaction/",
+                ('"ussd_app_transaction"."extra"', '"ussd_app_ussdsession"."data"'),
+            ),
+            (
+                "/admin/ussd_app/retrievalrequest/",
+                (
+                    '"ussd_app_retrievalrequest"."notes"',
+                    '"ussd_app_transaction"."extra"',
+                ),
+            ),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(client.get(url).status_code, 200)
+            listed = [q["sql"] for q in queries if "LIMIT" in q["sql"]]
+            self.assertTrue(listed, url)
+            for sql in listed:
+                for column in deferred:
+                    self.assertNotIn(column, sql)
+
+
+# --- performance regression suite ---
+
+# Upper bounds per request. Raise a budget only together with the change that
+# needs the extra queries; CPU budgets scale with USSD_PERF_CPU_SCALE for
+# slow CI machines.
+QUERY_BUDGETS = {
+    "initiation": 6,
+    "main_menu": 3,
+    "quantity": 3,
+    "quantity_returning": 7,
+    "quantity_invalid": 2,
+    "name": 3,
+    "phone": 7,
+    "confirm": 4,
+    "cancel": 3,
+    "rv_name": 3,
+    "rv_phone_matched": 5,
+    "rv_phone_no_record": 5,
+    "timeout": 3,
+    "fallback": 2,
+    "fulfillment_paid": 8,
+    "fulfillment_failed": 3,
+}
+CPU_BUDGET_MS = 25
+FULFILLMENT_CPU_BUDGET_MS = 60
+CPU_SCALE = float(os.getenv("USSD_PERF_CPU_SCALE", 1))
+
+
+class HotPathBudgetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.hubtel = FakeHubtel().__enter__()
+        cls.hubtel_settings = override_settings(
+            HUBTEL_CALLBACK_URL=f"{cls.hubtel.url}/callback"
+        )
+        cls.hubtel_settings.enable()
+        # first request pays for URL resolution and imports, not measured
+        hop(Client(), "warm-up", msg_type="Initiation")
+        import requests
+
+        requests.post(f"{cls.hubtel.url}/warm-up", json={}, timeout=5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hubtel_settings.disable()
+        cls.hubtel.__exit__()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        get_wassce_price_cents()  # steady state: price served from cache
+
+    def measure(self, label, func, cpu_budget_ms=CPU_BUDGET_MS):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.thread_time()
+            response = func()
+            cpu_ms = (time.thread_time() - start) * 1000
+        self.assertEqual(response.status_code, 200, label)
+        budget = QUERY_BUDGETS[label]
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            f"{label}: {len(queries)} queries, budget is {budget}:\n"
+            + "\n".join(q["sql"] for q in queries.captured_queries),
+        )
+        self.assertLessEqual(
+            cpu_ms,
+            cpu_budget_ms * CPU_SCALE,
+            f"{label}: {cpu_ms:.1f} ms CPU, budget is {cpu_budget_ms * CPU_SCALE:.1f} ms",
+        )
+        return response.json()
+
+    def session_at(self, session_id, step, **data):
+        return USSDSession.objects.create(
+            session_id=session_id, mobile=MOBILE, step=step, data=data
+        )
+
+    def test_initiation(self):
+        resp = self.measure("initiation", lambda: hop(self.client, "p", "Initiation"))
+        self.assertEqual(resp["Label"], "Main Menu")
+
+    def test_main_menu(self):
+        self.session_at("p", 1)
+        resp = self.measure("main_menu", lambda: hop(self.client, "p", message="1"))
+        self.assertEqual(resp["Label"], "Quantity")
+
+    def test_quantity(self):
+        self.session_at("p", 2)
+        resp = self.measure("quantity", lambda: hop(self.client, "p", message="2"))
+        self.assertEqual(resp["Label"], "Name")
+
+    def test_quantity_returning_customer(self):
+        self.session_at("p", 2, name="Ama Mensah", receiver_phone="0240000000")
+        resp = self.measure(
+            "quantity_returning", lambda: hop(self.client, "p", message="2")
+        )
+        self.assertEqual(resp["Label"], "Confirm Purchase")
+
+    def test_quantity_invalid(self):
+        self.session_at("p", 2)
+        resp = self.measure(
+            "quantity_invalid", lambda: hop(self.client, "p", message="many")
+        )
+        self.assertEqual(resp["Label"], "Quantity")
+
+    def test_name(self):
+        self.session_at("p", 3, qty=1)
+        resp = self.measure("name", lambda: hop(self.client, "p", message="Ama Mensah"))
+        self.assertEqual(resp["Label"], "Phone")
+
+    def test_phone(self):
+        self.session_at("p", 4, qty=1, name="Ama Mensah")
+        resp = self.measure(
+            "phone", lambda: hop(self.client, "p", message="0240000000")
+        )
+        self.assertEqual(resp["Label"], "Confirm Purchase")
+
+    def test_confirm(self):
+        session = self.session_at("p", 5, qty=1)
+        Transaction.objects.create(
+            session=session, client_reference="p", amount_cents=2400
+        )
+        resp = self.measure("confirm", lambda: hop(self.client, "p", message="1"))
+        self.assertEqual(resp["Type"], "AddToCart")
+
+    def test_cancel(self):
+        session = self.session_at("p", 5, qty=1)
+        Transaction.objects.create(
+            session=session, client_reference="p", amount_cents=2400
+        )
+        resp = self.measure("cancel", lambda: hop(self.client, "p", message="2"))
+        self.assertEqual(resp["Label"], "Cancelled")
+
+    def test_retrieval_name(self):
+        self.session_at("p", 101)
+        resp = self.measure(
+            "rv_name", lambda: hop(self.client, "p", message="Ama Mensah")
+        )
+        self.assertEqual(resp["Label"], "Voucher Phone")
+
+    def test_retrieval_phone_matched(self):
+        for i in range(20):
+            other = self.session_at(
+                f"old{i}", 0, name=f"Buyer {i}", receiver_phone="0200000000"
+            )
+            Transaction.objects.create(
+                session=other,
+                client_reference=other.session_id,
+                amount_cents=2400,
+                status="success",
+                **transaction_match_keys(other.data),
+            )
+        buyer = self.session_at(
+            "old", 0, name="Ama Mensah", receiver_phone="0240000000"
+        )
+        Transaction.objects.create(
+            session=buyer,
+            client_reference="old",
+            amount_cents=2400,
+            status="success",
+            **transaction_match_keys(buyer.data),
+        )
+        self.session_at("p", 102, rv_name="Ama Mensah")
+        resp = self.measure(
+            "rv_phone_matched", lambda: hop(self.client, "p", message="0240000000")
+        )
+        self.assertEqual(resp["Label"], "Voucher Request Received")
+
+    def test_retrieval_phone_no_record(self):
+        self.session_at("p", 102, rv_name="Nobody")
+        resp = self.measure(
+            "rv_phone_no_record", lambda: hop(self.client, "p", message="0249999999")
+        )
+        self.assertEqual(resp["Label"], "No Record Found")
+
+    def test_timeout(self):
+        self.session_at("p", 3)
+        resp = self.measure("timeout", lambda: hop(self.client, "p", "Timeout"))
+        self.assertEqual(resp["Label"], "Timeout")
+
+    def test_fallback(self):
+        self.session_at("p", 1)
+        resp = self.measure("fallback", lambda: hop(self.client, "p", message="9"))
+        self.assertEqual(resp["Label"], "Error")
+
+    def test_fulfillment_paid(self):
+        session = self.session_at(
+            "p", 5, qty=1, name="Ama Mensah", receiver_phone="0240000000"
+        )
+        Transaction.objects.create(
+            session=session, client_reference="p", amount_cents=2400
+        )
+        calls = len(self.hubtel.calls)
+        self.measure(
+            "fulfillment_paid",
+            lambda: fulfill(self.client, "p"),
+            cpu_budget_ms=FULFILLMENT_CPU_BUDGET_MS,
+        )
+        self.assertEqual(self.hubtel.calls[calls][1]["ServiceStatus"], "success")
+        self.assertEqual(
+            Transaction.objects.get(client_reference="p").status, "success"
+        )
+
+    def test_fulfillment_failed(self):
+        session = self.session_at("p", 5, qty=1)
+        Transaction.objects.create(
+            session=session, client_reference="p", amount_cents=2400
+        )
+        calls = len(self.hubtel.calls)
+        self.measure(
+            "fulfillment_failed",
+            lambda: fulfill(self.client, "p", status="Unpaid"),
+            cpu_budget_ms=FULFILLMENT_CPU_BUDGET_MS,
+        )
+        self.assertEqual(self.hubtel.calls[calls][1]["ServiceStatus"], "failed")
+        self.assertEqual(Transaction.objects.get(client_reference="p").status, "failed")
+
+
+# --- capture ---
+
+
+class CaptureReplayTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def record(self, i):
+        body = {"SessionId": f"cap{i % 3}", "Type": "Response", "Message": str(i)}
+        return {
+            "ts": time.time() + i / 1000,
+            "endpoint": "interaction",
+            "path": "/ussd_app/interaction/",
+            "request": json.dumps(body),
+            "status": 200,
+            "response": '{"ok": true}',
+            "duration_ms": 5.0,
+        }
+
+    def write_capture(self, count, **options):
+        writer = CaptureWriter(self.dir, **{"max_bytes": 10**6, "keep": 5, **options})
+        for i in range(count):
+            writer.submit(self.record(i))
+        writer.close()
+
+    def test_rotation_counts_uncompressed_bytes_and_keeps_own_files(self):
+        other_worker = os.path.join(self.dir, "capture-20000101-000000.0001-1.jsonl.gz")
+        with gzip.open(other_worker, "wt") as fh:
+            fh.write(json.dumps(self.record(99)) + "\n")
+
+        self.write_capture(30, max_bytes=200, keep=2)
+
+        own = [
+            f for f in os.listdir(self.dir) if f.endswith(f"-{os.getpid()}.jsonl.gz")
+        ]
+        self.assertEqual(len(own), 2)
+        self.assertTrue(os.path.exists(other_worker))
+        for name in own:
+            with gzip.open(os.path.join(self.dir, name), "rb") as fh:
+                lines = fh.read().splitlines(keepends=True)
+            self.assertLess(sum(map(len, lines[:-1])), 200)
+        # the newest records survive rotation
+        last = [r["request"] for r in read_capture([self.dir])][-1]
+        self.assertIn('"Message": "29"', last)
+
+    def test_replay_compares_latency(self):
+        self.write_capture(6)
+        out = io.StringIO()
+        with FakeHubtel() as target:
+            call_command(
+                "replay_capture", self.dir, base_url=target.url, speed=0, stdout=out
+            )
+
+        self.assertIn("Replayed 6 requests from 3 sessions", out.getvalue())
+        self.assertIn("Mean latency change", out.getvalue())
+
+    def test_replay_reports_connection_errors_and_fails(self):
+        self.write_capture(4)
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            dead_port = sock.getsockname()[1]
+        out = io.StringIO()
+
+        with self.assertRaisesMessage(CommandError, "4 of 4 requests got no response"):
+            call_command(
+                "replay_capture",
+                self.dir,
+                base_url=f"http://127.0.0.1:{dead_port}",
+                speed=0,
+                stdout=out,
+            )
+
+        self.assertIn("Failed requests (no response): 4", out.getvalue())
+        self.assertNotIn("Mean latency change", out.getvalue())
+
+
+# --- circuit_breaker ---
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch(
+            "ussd_app.circuit_breaker.time", monotonic=self.clock, time=self.clock
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(
+            "test", failure_threshold=2, recovery_seconds=30, slow_call_seconds=5
+        )
+
+    def fail(self, timeout):
+        raise OSError("down")
+
+    def trip(self):
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                self.breaker.call(self.fail)
+
+    def test_closed_open_half_open_closed(self):
+        self.assertEqual(self.breaker.call(lambda timeout: "ok"), "ok")
+        self.trip()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        called = []
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda timeout: called.append(1))
+        self.assertEqual(called, [])  # open: the endpoint is not touched
+
+        self.clock.now += 31
+        self.breaker.call(lambda timeout: "ok")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(
+            [t["to"] for t in self.breaker.transitions], ["open", "half_open", "closed"]
+        )
+
+    def test_failed_probe_reopens(self):
+        self.trip()
+        self.clock.now += 31
+        with self.assertRaises(OSError):
+            self.breaker.call(self.fail)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_slow_success_counts_as_failure(self):
+        def slow(timeout):
+            self.clock.now += 6
+
+        self.breaker.call(slow)
+        self.breaker.call(slow)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_only_one_probe_at_a_time(self):
+        self.trip()
+        self.clock.now += 31
+        self.breaker.before_call()  # the probe
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.breaker.record_success(0.1)
+        self.breaker.before_call()
+
+    def test_interrupted_probe_frees_the_slot(self):
+        self.trip()
+        self.clock.now += 31
+
+        def interrupted(timeout):
+            raise SystemExit(1)  # gunicorn's worker timeout
+
+        with self.assertRaises(SystemExit):
+            self.breaker.call(interrupted)
+
+        self.assertFalse(self.breaker.probe_in_flight)
+        self.assertEqual(self.breaker.call(lambda timeout: "ok"), "ok")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_timeout_follows_latency_average(self):
+        breaker = CircuitBreaker(
+            "ewma", min_timeout=1, max_timeout=10, timeout_multiplier=4, ewma_alpha=0.5
+        )
+        self.assertEqual(breaker.current_timeout(), 10)  # no data yet
+
+        breaker.record_success(0.5)
+        self.assertEqual(breaker.current_timeout(), 2.0)
+        breaker.record_success(1.5)  # average 1.0
+        self.assertEqual(breaker.current_timeout(), 4.0)
+        breaker.record_success(0.01)
+        breaker.record_success(0.01)
+        breaker.record_success(0.01)
+        self.assertEqual(breaker.current_timeout(), 1)  # clamped to min_timeout
+        breaker.record_failure(20)
+        self.assertEqual(breaker.current_timeout(), 10)  # clamped to max_timeout
+
+
+# --- db_router ---
+
+
+class ReadReplicaRouterTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("ussd_app.db_router.replica_configured", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReadReplicaRouter()
+
+    def test_hot_path_reads_stay_on_primary(self):
+        self.assertEqual(self.router.db_for_read(Transaction), "default")
+
+    def test_back_office_block_reads_from_replica(self):
+        with read_from_replica():
+            self.assertEqual(self.router.db_for_read(Transaction), "replica")
+            with read_from_replica():
+                self.assertEqual(self.router.db_for_read(USSDSession), "replica")
+            self.assertEqual(self.router.db_for_read(Transaction), "replica")
+        self.assertEqual(self.router.db_for_read(Transaction), "default")
+
+    def test_write_pins_block_to_primary(self):
+        with read_from_replica():
+            self.assertEqual(self.router.db_for_write(Transaction), "default")
+            self.assertEqual(self.router.db_for_read(Transaction), "default")
+        with read_from_replica():
+            self.assertEqual(self.router.db_for_read(Transaction), "replica")
+
+    def routed_reads(self, request):
+        """Run `request` and return the alias each read was routed to, by model."""
+        reads = []
+        original = ReadReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            reads.append((model.__name__, original(router, model, **hints)))
+            return "default"  # the test database has no replica alias
+
+        with mock.patch.object(
+            ReadReplicaRouter, "db_for_read", autospec=True, side_effect=spy
+        ):
+            request()
+        return reads
+
+    def test_funnel_report_reads_from_replica(self):
+        client = Client()
+        client.force_login(
+            User.objects.create_superuser("admin", "a@example.com", "pw")
+        )
+
+        reads = self.routed_reads(lambda: client.get("/admin/ussd_app/funnelcounter/"))
+
+        self.assertIn(("FunnelCounter", "replica"), reads)
+
+    def test_admin_actions_read_from_primary(self):
+        client = Client()
+        client.force_login(
+            User.objects.create_superuser("admin", "a@example.com", "pw")
+        )
+        rr = RetrievalRequest.objects.create(name="Ama Mensah", phone="0209998888")
+
+        reads = self.routed_reads(
+            lambda: client.get("/admin/ussd_app/retrievalrequest/")
+        )
+        self.assertIn(("RetrievalRequest", "replica"), reads)
+        reads = self.routed_reads(
+            lambda: client.post(
+                "/admin/ussd_app/retrievalrequest/",
+                {"action": "rematch_requests", "_selected_action": [rr.pk]},
+            )
+        )
+        self.assertNotIn("replica", {alias for _, alias in reads})
+
+    def test_replica_is_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica", "ussd_app"))
+        self.assertTrue(self.router.allow_migrate("default", "ussd_app"))
+
+
+# --- deadline ---
+
+
+class DeadlineTests(TestCase):
+    @override_settings(USSD_DEADLINE_SECONDS=0)
+    def test_spent_budget_returns_try_again_release(self):
+        funnel.reset()
+        self.addCleanup(funnel.reset)
+
+        resp = hop(Client(), "late", msg_type="Initiation").json()
+
+        self.assertEqual(resp["Type"], "release")
+        self.assertEqual(resp["Label"], "Try Again")
+        self.assertEqual(resp["SessionId"], "late")
+        funnel.flush()
+        self.assertTrue(
+            FunnelCounter.objects.filter(step="interaction", outcome="overrun").exists()
+        )
+
+    def test_other_database_errors_propagate(self):
+        broken = OperationalError("no such table: ussd_app_ussdsession")
+        with mock.patch.object(
+            USSDSession.objects, "get_or_create_recent", side_effect=broken
+        ):
+            with self.assertRaises(OperationalError):
+                hop(Client(), "broken", msg_type="Initiation")
+
+    def test_only_timeouts_count_as_overruns(self):
+        import sqlite3
+
+        class DriverError(Exception):
+            def __init__(self, sqlstate):
+                self.sqlstate = sqlstate
+
+        def wrapped(cause):
+            error = OperationalError(str(cause))
+            error.__cause__ = cause
+            return error
+
+        self.assertTrue(is_timeout(wrapped(DriverError("57014"))))  # statement_timeout
+        self.assertTrue(is_timeout(wrapped(DriverError("55P03"))))  # lock_timeout
+        self.assertFalse(is_timeout(wrapped(DriverError("08006"))))  # connection lost
+        try:
+            sqlite3.connect(":memory:").execute("SELECT * FROM missing")
+        except sqlite3.OperationalError as e:
+            self.assertFalse(is_timeout(wrapped(e)))
+        self.assertTrue(is_timeout(OperationalError("database is locked")))
+
+
+class DeadlineLockTests(TransactionTestCase):
+    @override_settings(USSD_DEADLINE_SECONDS=0.5)
+    def test_locked_database_fails_fast(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("uses an SQLite write lock")
+        import sqlite3
+
+        holder = sqlite3.connect(connection.settings_dict["NAME"], isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")  # hold the write lock
+        try:
+            start = time.monotonic()
+            resp = hop(Client(), "locked", msg_type="Initiation").json()
+            elapsed = time.monotonic() - start
+        finally:
+            holder.execute("ROLLBACK")
+            holder.close()
+
+        self.assertEqual(resp["Label"], "Try Again")
+        self.assertLess(elapsed, 2.0)
+
+
+# --- funnel ---
+
+
+class FunnelTests(TestCase):
+    def setUp(self):
+        funnel.reset()  # drop counts left by other tests
+        self.addCleanup(funnel.reset)
+
+    def counts(self):
+        return {(c.step, c.outcome): c.count for c in FunnelCounter.objects.all()}
+
+    def test_purchase_flow_is_counted_per_step(self):
+        client = Client()
+        hop(client, "f1", msg_type="Initiation")
+        hop(client, "f1", message="1")
+        hop(client, "f1", message="zero")  # invalid quantity
+        hop(client, "f1", message="2")
+        hop(client, "f1", message="Ama Mensah")
+        hop(client, "f1", message="0240000000")
+        hop(client, "f1", message="1")
+
+        self.assertEqual(FunnelCounter.objects.count(), 0)  # nothing written yet
+        funnel.flush()
+        counts = self.counts()
+
+        self.assertEqual(counts[("main_menu", "entered")], 1)
+        self.assertEqual(counts[("quantity", "invalid")], 1)
+        self.assertEqual(counts[("quantity", "advanced")], 1)
+        self.assertEqual(counts[("confirm", "add_to_cart")], 1)
+
+    def test_flush_adds_to_existing_bucket(self):
+        funnel.record(1, "entered")
+        funnel.flush()
+        funnel.record(1, "entered")
+        funnel.record(1, "timed_out")
+        funnel.flush()
+
+        counts = self.counts()
+        self.assertEqual(counts[("main_menu", "entered")], 2)
+        self.assertEqual(counts[("main_menu", "timed_out")], 1)
+
+    def test_admin_report_shows_conversion(self):
+        funnel.record(1, "entered")
+        funnel.record(1, "entered")
+        funnel.record(1, "advanced")
+        funnel.flush()
+        client = Client()
+        client.force_login(
+            User.objects.create_superuser("admin", "a@example.com", "pw")
+        )
+
+        resp = client.get("/admin/ussd_app/funnelcounter/?period=hour")
+
+        self.assertContains(resp, "Main Menu")
+        self.assertContains(resp, "50.0%")
+
+    def test_failed_flush_keeps_counts(self):
+        funnel.record(1, "entered")
+        funnel.record(2, "entered")
+        with mock.patch.object(
+            FunnelCounter.objects, "filter", side_effect=OperationalError("locked")
+        ):
+            with self.assertRaises(OperationalError):
+                funnel.flush()
+
+        funnel.flush()
+        self.assertEqual(
+            self.counts(), {("main_menu", "entered"): 1, ("quantity", "entered"): 1}
+        )
+
+    def test_gunicorn_worker_exit_flushes(self):
+        from programmable_ussd_project.gunicorn_conf import worker_exit
+
+        funnel.record(1, "entered")
+        with mock.patch("django.db.connection.close"):
+            worker_exit(None, mock.Mock())
+
+        self.assertEqual(self.counts(), {("main_menu", "entered"): 1})
+
+
+# --- memory ---
+
+
+class MemoryTelemetryTests(TestCase):
+    def setUp(self):
+        memory.reset()
+
+    def test_requests_are_tracked_per_endpoint(self):
+        hop(Client(), "mem1", msg_type="Initiation")
+        hop(Client(), "mem1", message="1")
+
+        admin_user = User.objects.create_superuser("admin", "a@example.com", "pw")
+        client = Client()
+        client.force_login(admin_user)
+        data = client.get("/admin/worker-memory/").json()
+
+        self.assertEqual(data["pid"], os.getpid())
+        self.assertGreater(data["rss"], 0)
+        self.assertEqual(data["endpoints"]["interaction"]["requests"], 2)
+        self.assertGreater(data["endpoints"]["interaction"]["max_rss"], 0)
+
+    def test_worker_recycles_over_budget(self):
+        from programmable_ussd_project.gunicorn_conf import post_request
+
+        worker = mock.Mock(alive=True, pid=1)
+        with override_settings(USSD_MEMORY_BUDGET_MB=0):
+            post_request(worker, None, {}, None)
+            self.assertTrue(worker.alive)
+        with override_settings(USSD_MEMORY_BUDGET_MB=1):
+            post_request(worker, None, {}, None)
+            self.assertFalse(worker.alive)
+
+    def test_worker_memory_needs_admin_login(self):
+        resp = Client().get("/admin/worker-memory/")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn("/admin/login/", resp["Location"])
+
+    @mock.patch("programmable_ussd_project.gunicorn_conf.os.kill")
+    def test_uvicorn_worker_recycles_over_budget(self, kill):
+        import signal
+
+        from programmable_ussd_project.gunicorn_conf import watch_memory_budget
+
+        worker = mock.Mock(pid=1234)
+        with override_settings(USSD_MEMORY_BUDGET_MB=0):
+            self.assertIsNone(watch_memory_budget(worker, interval=0.01))
+        with override_settings(USSD_MEMORY_BUDGET_MB=1):
+            watch_memory_budget(worker, interval=0.01).join(timeout=5)
+
+        kill.assert_called_once_with(1234, signal.SIGTERM)
+
+
+# --- partition_tables ---
+
+
+class PartitioningTests(TestCase):
+    def age(self, days=400):
+        then = timezone.now() - timedelta(days=days)
+        USSDSession.objects.update(created_at=then)
+        Transaction.objects.update(created_at=then)
+
+    @mock.patch("ussd_app.views.post_callback")
+    def test_hot_path_lookup_is_bounded_by_the_window(self, post_callback):
+        session = USSDSession.objects.create(session_id="new", mobile=MOBILE, step=5)
+        Transaction.objects.create(
+            session=session, client_reference="new", amount_cents=2400
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(fulfill(Client(), "new").status_code, 200)
+
+        lookups = [
+            q["sql"] for q in ctx.captured_queries if q["sql"].startswith("SELECT")
+        ]
+        self.assertIn('"created_at" >=', lookups[0])
+
+    @mock.patch("ussd_app.views.post_callback")
+    def test_fulfillment_resolves_transactions_older_than_the_window(
+        self, post_callback
+    ):
+        session = USSDSession.objects.create(session_id="old", mobile=MOBILE, step=5)
+        Transaction.objects.create(
+            session=session, client_reference="old", amount_cents=2400
+        )
+        self.age()
+
+        self.assertEqual(fulfill(Client(), "old").status_code, 200)
+        self.assertEqual(
+            Transaction.objects.get(client_reference="old").status, "success"
+        )
+
+    def test_sessions_older_than_the_window_are_reused(self):
+        hop(Client(), "old", msg_type="Initiation")
+        self.age()
+
+        resp = hop(Client(), "old", message="1", sequence=2)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(USSDSession.objects.filter(session_id="old").count(), 1)
+
+    def test_get_or_create_recent_falls_back_to_older_rows(self):
+        session = USSDSession.objects.create(session_id="old", mobile=MOBILE)
+        Transaction.objects.create(
+            session=session, client_reference="old", amount_cents=2400
+        )
+        self.age()
+
+        tx, created = Transaction.objects.get_or_create_recent(
+            client_reference="old", defaults={"session": session, "amount_cents": 0}
+        )
+
+        self.assertFalse(created)
+        self.assertEqual(tx.amount_cents, 2400)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_month_arithmetic_and_names(self):
+        self.assertEqual(add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(
+            partition_name("ussd_app_transaction", date(2026, 2, 1)),
+            "ussd_app_transaction_p202602",
+        )
+
+    @skipIf(connection.vendor == "postgresql", "the command runs there")
+    def test_command_refuses_non_postgres(self):
+        with self.assertRaisesMessage(CommandError, "needs PostgreSQL"):
+            call_command("partition_tables")
+
+
+@skipUnless(
+    connection.vendor == "postgresql", "partitioning needs PostgreSQL (DATABASE_URL)"
+)
+class PostgresPartitioningTests(TestCase):
+    def setUp(self):
+        call_command("partition_tables", "--convert", stdout=io.StringIO())
+        self.next_month = add_months(timezone.now().date().replace(day=1), 1)
+
+    def move_to_next_month(self, model, pk):
+        later = timezone.now().replace(
+            year=self.next_month.year, month=self.next_month.month, day=2
+        )
+        model.objects.filter(pk=pk).update(created_at=later)
+        return model.objects.get(pk=pk)
+
+    def test_tables_are_partitioned_by_month(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname, relkind FROM pg_class WHERE relname = ANY(%s) ORDER BY relname",
+                [
+                    [
+                        "ussd_app_transaction",
+                        partition_name("ussd_app_transaction", self.next_month),
+                    ]
+                ],
+            )
+            self.assertEqual([kind for _, kind in cursor.fetchall()], ["p", "r"])
+
+    def test_references_stay_unique_across_partitions(self):
+        first = USSDSession.objects.create(session_id="dup", mobile=MOBILE)
+        self.move_to_next_month(USSDSession, first.pk)
+
+        # the legacy partition's own unique index no longer sees "dup"
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            USSDSession.objects.create(session_id="dup", mobile=MOBILE)
+        session, created = USSDSession.objects.get_or_create_recent(
+            session_id="dup", defaults={"mobile": MOBILE}
+        )
+        self.assertEqual((session.pk, created), (first.pk, False))
+
+        USSDSession.objects.filter(pk=first.pk).delete()
+        USSDSession.objects.create(session_id="dup", mobile=MOBILE)  # claim released
+
+    def test_row_writes_touch_one_partition(self):
+        session = self.move_to_next_month(
+            USSDSession, USSDSession.objects.create(session_id="s", mobile=MOBILE).pk
+        )
+        bounded = USSDSession.objects.filter(
+            pk=session.pk, created_at=session.created_at
+        )
+
+        self.assertNotIn("_legacy", bounded.explain())
+        self.assertIn("_legacy", USSDSession.objects.filter(pk=session.pk).explain())
+        session.step = 4
+        session.update_row()
+        self.assertEqual(USSDSession.objects.get(pk=session.pk).step, 4)
+
+    @mock.patch("ussd_app.views.post_callback")
+    def test_purchase_flow_runs_on_partitioned_tables(self, post_callback):
+        client = Client()
+        hop(client, "flow", msg_type="Initiation")
+        for message in ("1", "1", "Ama Mensah", "0209998888", "1"):
+            hop(client, "flow", message=message)
+
+        self.assertEqual(fulfill(client, "flow").status_code, 200)
+        self.assertEqual(
+            Transaction.objects.get(client_reference="flow").status, "success"
+        )
+
+
+# --- pools ---
+
+
+class WorkerPoolTests(SimpleTestCase):
+    def test_paths_route_to_their_pool(self):
+        from programmable_ussd_project.pools import pick_pool
+
+        self.assertEqual(pick_pool("/ussd_app/interaction/"), "ussd")
+        self.assertEqual(pick_pool("/ussd_app/fulfillment/"), "fulfillment")
+        self.assertEqual(pick_pool("/admin/ussd_app/transaction/recheck/1/"), "admin")
+        self.assertEqual(pick_pool("/"), "admin")
+
+    def test_keep_alive_connection_routes_each_request(self):
+        import asyncio
+        import re
+
+        from programmable_ussd_project.pools import POOLS, Router
+
+        async def fake_pool(name, reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = re.search(rb"Content-Length: (\d+)", head)
+            if b"chunked" in head:
+                body = await reader.readuntil(b"0\r\n\r\n")
+            else:
+                body = await reader.readexactly(int(length[1])) if length else b""
+            path = head.split(b" ")[1]
+            reply = b"%s %s %s %s" % (
+                name.encode(),
+                path,
+                body,
+                b"close" if b"Connection: close" in head else b"kept",
+            )
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(reply), reply)
+            )
+            await writer.drain()
+            writer.close()
+
+        async def scenario(socket_dir):
+            sockets = {}
+            for name in POOLS:
+                sockets[name] = os.path.join(socket_dir, f"{name}.sock")
+                await asyncio.start_unix_server(
+                    lambda r, w, name=name: fake_pool(name, r, w), sockets[name]
+                )
+            server = await asyncio.start_server(Router(sockets).handle, "127.0.0.1", 0)
+            reader, writer = await asyncio.open_connection(
+                *server.sockets[0].getsockname()[:2]
+            )
+            # pipelined on one kept-alive connection, as a proxy may send them
+            writer.write(
+                b"POST /ussd_app/interaction/ HTTP/1.1\r\nHost: x\r\nContent-Length: 2\r\n\r\n{}"
+                b"GET /admin/ HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n"
+                b"POST /ussd_app/fulfillment/ HTTP/1.1\r\nHost: x\r\n"
+                b"Transfer-Encoding: chunked\r\n\r\n2\r\n[]\r\n0\r\n\r\n"
+            )
+            replies = []
+            for _ in range(3):
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = int(re.search(rb"Content-Length: (\d+)", head)[1])
+                replies.append(await reader.readexactly(length))
+            writer.close()
+            server.close()
+            return replies
+
+        with tempfile.TemporaryDirectory() as socket_dir:
+            replies = asyncio.run(scenario(socket_dir))
+
+        self.assertEqual(
+            replies,
+            [
+                b"ussd /ussd_app/interaction/ {} close",
+                b"admin /admin/  close",
+                b"fulfillment /ussd_app/fulfillment/ 2\r\n[]\r\n0\r\n\r\n close",
+            ],
+        )
+
+    @mock.patch.dict(os.environ, {"GUNICORN_USSD_WORKERS": "7"})
+    def test_pool_settings_take_env_overrides(self):
+        from programmable_ussd_project.gunicorn_conf import get_pool
+
+        self.assertEqual(get_pool("ussd")["workers"], 7)
+        with self.assertRaises(ValueError):
+            get_pool("reports")
+
+
+# --- profiling ---
+
+
+class ProfilingTests(TestCase):
+    def test_middleware_is_dropped_when_off(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+    @override_settings(USSD_PROFILE_TOKEN="secret")
+    def test_header_profiles_request_with_tags(self):
+        client = Client()
+        hop(client, "prof1", msg_type="Initiation")
+        self.assertFalse(ProfileCapture.objects.exists())
+
+        client.post(
+            "/ussd_app/interaction/",
+            json.dumps(
+                {
+                    "SessionId": "prof1",
+                    "Type": "Response",
+                    "Message": "1",
+                    "Mobile": MOBILE,
+                }
+            ),
+            content_type="application/json",
+            HTTP_X_USSD_PROFILE="secret",
+        )
+
+        capture = ProfileCapture.objects.get()
+        self.assertEqual(
+            (capture.endpoint, capture.session_id, capture.step),
+            ("interaction", "prof1", 1),
+        )
+        self.assertEqual(capture.trigger, "header")
+        for line in capture.stacks.splitlines():
+            self.assertGreater(int(line.rsplit(" ", 1)[1]), 0)
+        self.assertIn("ussd_app.views.interaction", capture.stacks)
+
+        admin_user = User.objects.create_superuser("admin", "a@example.com", "pw")
+        client.force_login(admin_user)
+        self.assertContains(client.get("/admin/ussd_app/profilecapture/"), "prof1")
+        self.assertContains(
+            client.get(f"/admin/ussd_app/profilecapture/{capture.pk}/change/"),
+            "interaction",
+        )
+        folded = client.get(f"/admin/ussd_app/profilecapture/{capture.pk}/folded/")
+        self.assertEqual(folded.content.decode().strip(), capture.stacks)
+
+    @override_settings(USSD_PROFILE_TOKEN="secret")
+    def test_wrong_token_is_not_profiled(self):
+        Client().post(
+            "/ussd_app/interaction/",
+            json.dumps({"SessionId": "prof2", "Type": "Initiation", "Mobile": MOBILE}),
+            content_type="application/json",
+            HTTP_X_USSD_PROFILE="guess",
+        )
+        self.assertFalse(ProfileCapture.objects.exists())
+
+
+# --- reconcile_settlement ---
+
+
+class ReconcileSettlementTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        for ref, status, order_id in (
+            ("ok", "success", "ORD-1"),
+            ("late", "pending", None),
+            ("paid", "success", "ORD-3"),
+            ("refund", "success", "ORD-4"),
+            ("unsettled", "success", "ORD-5"),
+        ):
+            session = USSDSession.objects.create(session_id=ref, mobile=MOBILE)
+            Transaction.objects.create(
+                session=session,
+                client_reference=ref,
+                order_id=order_id,
+                amount_cents=2400,
+                status=status,
+            )
+
+    def reconcile(self, rows, *args):
+        export = os.path.join(self.dir, "settlement.csv")
+        with open(export, "w", newline="") as fh:
+            writer = csv.DictWriter(
+                fh, fieldnames=("ClientReference", "OrderId", "Amount", "Status")
+            )
+            writer.writeheader()
+            writer.writerows(rows)
+        report = os.path.join(self.dir, "report.csv")
+        today = timezone.localdate().isoformat()
+        call_command(
+            "reconcile_settlement",
+            export,
+            "--from",
+            today,
+            "--to",
+            today,
+            "--output",
+            report,
+            *args,
+            stderr=io.StringIO(),
+        )
+        with open(report, newline="") as fh:
+            return {(r["kind"], r["client_reference"]) for r in csv.DictReader(fh)}
+
+    def rows(self):
+        return [
+            {
+                "ClientReference": "ok",
+                "OrderId": "ORD-1",
+                "Amount": "24.00",
+                "Status": "Paid",
+            },
+            {
+                "ClientReference": "late",
+                "OrderId": "ORD-2",
+                "Amount": "24.00",
+                "Status": "Paid",
+            },
+            {
+                "ClientReference": "paid",
+                "OrderId": "ORD-3",
+                "Amount": "20.00",
+                "Status": "Pending",
+            },
+            {
+                "ClientReference": "refund",
+                "OrderId": "ORD-4",
+                "Amount": "24.00",
+                "Status": "Refunded",
+            },
+            {
+                "ClientReference": "ghost",
+                "OrderId": "ORD-9",
+                "Amount": "24.00",
+                "Status": "Paid",
+            },
+        ]
+
+    def statuses(self):
+        return dict(Transaction.objects.values_list("client_reference", "status"))
+
+    def test_reports_mismatches_and_missing_rows(self):
+        report = self.reconcile(self.rows())
+
+        self.assertEqual(
+            report,
+            {
+                ("status_differs", "late"),
+                ("amount_differs", "paid"),
+                ("status_differs", "paid"),
+                ("unknown_status", "refund"),
+                ("missing_local", "ghost"),
+                ("missing_settlement", "unsettled"),
+            },
+        )
+        self.assertEqual(self.statuses()["late"], "pending")  # no --fix, no writes
+
+    def test_fix_settles_rows_but_never_undoes_success(self):
+        self.reconcile(self.rows(), "--fix")
+
+        statuses = self.statuses()
+        self.assertEqual(statuses["late"], "success")
+        self.assertEqual(
+            Transaction.objects.get(client_reference="late").order_id, "ORD-2"
+        )
+        self.assertEqual(statuses["paid"], "success")  # settlement says pending
+        self.assertEqual(statuses["refund"], "success")  # unknown status skipped
+
+    def test_fix_keeps_order_id_of_a_concurrent_fulfillment(self):
+        from ussd_app.management.commands.reconcile_settlement import Command
+
+        apply_fixes = Command._apply_fixes
+
+        def fulfilled_meanwhile(command, fixes, batch_size):
+            Transaction.objects.filter(client_reference="late").update(
+                status="success", order_id="ORD-LIVE"
+            )
+            apply_fixes(command, fixes, batch_size)
+
+        with mock.patch.object(Command, "_apply_fixes", fulfilled_meanwhile):
+            self.reconcile(self.rows(), "--fix")
+
+        tx = Transaction.objects.get(client_reference="late")
+        self.assertEqual((tx.status, tx.order_id), ("success", "ORD-LIVE"))
+
+
+# --- retrieval ---
+
+
+class RematchRetrievalTests(TestCase):
+    def buy(self, session_id, name, phone, status):
+        USSDSession.objects.create(
+            session_id=session_id, mobile=MOBILE, step=4, data={"qty": 1, "name": name}
+        )
+        hop(Client(), session_id, message=phone)
+        Transaction.objects.filter(client_reference=session_id).update(status=status)
+        return Transaction.objects.get(client_reference=session_id)
+
+    def test_unresolved_requests_match_late_payments(self):
+        paid = self.buy("paid", "Ama Mensah", "0209998888", "success")
+        self.buy("unpaid", "Kofi Boateng", "0241112222", "pending")
+        waiting = RetrievalRequest.objects.create(
+            name="ama  MENSAH", phone="233209998888", status="no_record"
+        )
+        unpaid = RetrievalRequest.objects.create(
+            name="Kofi Boateng", phone="0241112222", status="no_record"
+        )
+        done = RetrievalRequest.objects.create(
+            name="Ama Mensah", phone="0209998888", status="matched"
+        )
+
+        delivered = []
+
+        def receiver(sender, requests, **kwargs):
+            delivered.extend(requests)
+
+        voucher_requests_matched.connect(receiver)
+        self.addCleanup(voucher_requests_matched.disconnect, receiver)
+        call_command("rematch_retrievals", stdout=io.StringIO())
+
+        waiting.refresh_from_db()
+        self.assertEqual(
+            (waiting.status, waiting.matched_transaction_id), ("matched", paid.pk)
+        )
+        self.assertIn("rematched_at", waiting.notes)
+        self.assertEqual(RetrievalRequest.objects.get(pk=unpaid.pk).status, "no_record")
+        self.assertIsNone(
+            RetrievalRequest.objects.get(pk=done.pk).matched_transaction_id
+        )
+        self.assertEqual([rr.pk for rr in delivered], [waiting.pk])
+
+    def test_live_retrieval_matches_on_the_stored_keys(self):
+        paid = self.buy("paid", "Ama  Mensah", "0209998888", "success")
+        USSDSession.objects.create(
+            session_id="rv", mobile=MOBILE, step=102, data={"rv_name": "ama mensah"}
+        )
+
+        resp = hop(Client(), "rv", message="233209998888").json()
+
+        self.assertEqual(resp["Label"], "Voucher Request Received")
+        rr = RetrievalRequest.objects.get(session__session_id="rv")
+        self.assertEqual(rr.matched_transaction_id, paid.pk)
+
+    def test_match_keys_fall_back_to_the_paying_number(self):
+        self.assertEqual(
+            transaction_match_keys({"name": " Ama "}, "", "233241234567"),
+            {"match_name": "ama", "match_phone": "241234567"},
+        )
+        self.assertEqual(
+            transaction_match_keys({"receiver_phone": "0209998888"}, "0241234567")[
+                "match_phone"
+            ],
+            "209998888",
+        )
+
+    def test_admin_action_rematches_selection(self):
+        self.buy("paid", "Ama Mensah", "0209998888", "success")
+        rr = RetrievalRequest.objects.create(name="Ama Mensah", phone="0209998888")
+        client = Client()
+        client.force_login(
+            User.objects.create_superuser("admin", "a@example.com", "pw")
+        )
+
+        client.post(
+            "/admin/ussd_app/retrievalrequest/",
+            {"action": "rematch_requests", "_selected_action": [rr.pk]},
+        )
+
+        self.assertEqual(RetrievalRequest.objects.get(pk=rr.pk).status, "matched")
+
+
+# --- search ---
+
+
+class AdminSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser("admin", "a@example.com", "pw")
+        session = USSDSession.objects.create(session_id="abc123", mobile="233241112222")
+        Transaction.objects.create(
+            session=session,
+            client_reference="abc123",
+            order_id="ORD-778",
+            amount_cents=2400,
+        )
+        for name, phone in (
+            ("Ama Mensah", "0241112222"),
+            ("Kwame Mensah", "0205550000"),
+            ("Akosua Boateng", "0247770000"),
+        ):
+            RetrievalRequest.objects.create(name=name, phone=phone)
+
+    def search(self, model_admin, term):
+        request = mock.Mock(user=self.admin_user)
+        qs, _ = model_admin.get_search_results(
+            request, model_admin.model.objects.all(), term
+        )
+        return qs
+
+    def admin_for(self, model):
+        from django.contrib import admin
+
+        return admin.site._registry[model]
+
+    def test_name_search_matches_all_word_prefixes(self):
+        rr_admin = self.admin_for(RetrievalRequest)
+
+        names = set(self.search(rr_admin, "mens").values_list("name", flat=True))
+        self.assertEqual(names, {"Ama Mensah", "Kwame Mensah"})
+        names = set(self.search(rr_admin, "ama mens").values_list("name", flat=True))
+        self.assertEqual(names, {"Ama Mensah"})
+
+    def test_fts_index_follows_updates(self):
+        rr_admin = self.admin_for(RetrievalRequest)
+        RetrievalRequest.objects.filter(name="Akosua Boateng").update(
+            name="Efua Boateng"
+        )
+
+        self.assertFalse(self.search(rr_admin, "akosua").exists())
+        self.assertTrue(self.search(rr_admin, "efua").exists())
+
+    def test_phone_search_accepts_local_and_international_prefix(self):
+        rr_admin = self.admin_for(RetrievalRequest)
+        session_admin = self.admin_for(USSDSession)
+
+        self.assertEqual(self.search(rr_admin, "233241112").count(), 1)
+        self.assertEqual(self.search(session_admin, "0241112").count(), 1)
+
+    def test_phone_search_finds_numbers_stored_with_separators(self):
+        rr_admin = self.admin_for(RetrievalRequest)
+        RetrievalRequest.objects.create(name="Yaw Asante", phone="024-333 4444")
+
+        for term in ("0243334444", "233 24 333", "24333"):
+            self.assertEqual(self.search(rr_admin, term).get().name, "Yaw Asante")
+        if connection.vendor == "sqlite":
+            self.assertIn(
+                "rr_match_phone_prefix_idx", self.search(rr_admin, "024333").explain()
+            )
+
+    def test_customer_profiles_search_by_name_or_mobile(self):
+        profile_admin = self.admin_for(CustomerProfile)
+        CustomerProfile.remember("0241112222", "Ama Mensah", "0209998888")
+        CustomerProfile.remember("0205550000", "Kofi Boateng", "0205550000")
+
+        self.assertEqual(
+            list(self.search(profile_admin, "ama").values_list("name", flat=True)),
+            ["Ama Mensah"],
+        )
+        self.assertFalse(self.search(profile_admin, "Zzz").exists())
+        self.assertEqual(
+            self.search(profile_admin, "020555").get().name, "Kofi Boateng"
+        )
+
+    def test_term_no_index_can_serve_matches_nothing(self):
+        class PhoneOnlyAdmin(IndexedSearchMixin):
+            phone_search_fields = ("phone",)
+
+        qs, _ = PhoneOnlyAdmin().get_search_results(
+            None, RetrievalRequest.objects.all(), "no digits"
+        )
+
+        self.assertFalse(qs.exists())
+
+    def test_transaction_id_search_uses_index(self):
+        tx_admin = self.admin_for(Transaction)
+        qs = self.search(tx_admin, "ORD-7")
+
+        self.assertEqual(qs.count(), 1)
+        if connection.vendor == "sqlite":
+            plan = qs.explain()
+            self.assertNotIn(
+                "SCAN ussd_app_transaction", plan.replace("SCAN TABLE", "SCAN")
+            )
+            self.assertIn("INDEX", plan)
+
+    def test_prefix_search_ignores_case(self):
+        tx_admin = self.admin_for(Transaction)
+        session_admin = self.admin_for(USSDSession)
+
+        self.assertEqual(self.search(tx_admin, "ord-77").count(), 1)
+        self.assertEqual(self.search(session_admin, "ABC1").count(), 1)
+        if connection.vendor == "sqlite":
+            plan = self.search(session_admin, "ABC1").explain()
+            self.assertIn("session_id_prefix_idx", plan)
+
+    def test_changelist_search_renders(self):
+        self.client.force_login(self.admin_user)
+
+        resp = self.client.get("/admin/ussd_app/retrievalrequest/", {"q": "kwame"})
+
+        self.assertContains(resp, "Kwame Mensah")
+        self.assertNotContains(resp, "Ama Mensah")
+
+
+# --- warmup ---
+
+
+class WarmUpTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch("ussd_app.warmup.connection")
+    def test_warm_up_primes_price_cache(self, connection):
+        Price.objects.create(item_code="wassce_checker", price_cents=3000)
+
+        timings = warm_up()
+
+        self.assertEqual(set(timings), {"price_cache", "url_resolver"})
+        self.assertEqual(cache.get(PRICE_CACHE_KEY), 3000)
+        connection.close.assert_called_once_with()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_wassce_price_cents(), 3000)
+
+    def test_price_change_invalidates_cache(self):
+        price = Price.objects.create(item_code="wassce_checker", price_cents=3000)
+        self.assertEqual(get_wassce_price_cents(), 3000)
+
+        price.price_cents = 3500
+        price.save()
+        self.assertEqual(get_wassce_price_cents(), 3500)
+
+        price.delete()
+        self.assertEqual(get_wassce_price_cents(), 2400)  # default placeholder
+
+    def test_price_changed_by_another_worker_is_picked_up_after_ttl(self):
+        Price.objects.create(item_code="wassce_checker", price_cents=3000)
+        self.assertEqual(get_wassce_price_cents(), 3000)
+
+        # no signal reaches this worker's cache
+        Price.objects.update(price_cents=3500)
+        self.assertEqual(get_wassce_price_cents(), 3000)
+
+        later = time.time() + settings.USSD_PRICE_CACHE_SECONDS + 1
+        with mock.patch(
+            "django.core.cache.backends.locmem.time.time", return_value=later
+        ):
+            self.assertEqual(get_wassce_price_cents(), 3500)
@@ -1,45 +1,109 @@
 # from venv import logger
-from django.shortcuts import render
 import json
 import logging
-from django.http import JsonResponse, HttpResponse
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from django.shortcuts import get_object_or_404
-from .models import USSDSession, Price, Transaction, RetrievalRequest
-import requests
-from django.conf import settings
-from dotenv import load_dotenv
-import re
-
-load_dotenv()
-import os
+from .models import (
+    USSDSession,
+    Price,
+    Transaction,
+    RetrievalRequest,
+    ProviderPayload,
+    CustomerProfile,
+)
+from . import funnel
+from .capture import captured
+from .circuit_breaker import CircuitOpenError
+from .deadline import deadline_bound
+from .hubtel import post_callback
+from .retrieval import voucher_requests_matched
+from .search import name_key, normalize_msisdn, phone_key, transaction_match_keys
+
+# .env is already loaded by settings.py
 
 logger = logging.getLogger(__name__)
 log = logging.getLogger("ussd")
 
 
-def get_proxies():
-    proxy_url = os.environ.get("QUOTAGUARD_URL")
-    if not proxy_url:
-        return None  # fail gracefully in local dev
-    return {
-        "http": proxy_url,
-        "https": proxy_url,
-    }
-
-
 # Create your views here.
 
 
 # Helpers
+PRICE_CACHE_KEY = "price:wassce_checker"
+
+
 def get_wassce_price_cents():
+    # cached per process (LocMem); the Price signals in signals.py clear only
+    # the worker that saved the change, so other workers may serve the old
+    # price for up to USSD_PRICE_CACHE_SECONDS after an admin edit
+    price_cents = cache.get(PRICE_CACHE_KEY)
+    if price_cents is not None:
+        return price_cents
     try:
         price = Price.objects.get(item_code="wassce_checker", active=True)
-        return price.price_cents
+        price_cents = price.price_cents
     except Price.DoesNotExist:
         # default placeholder (e.g., GHS 24.00)
-        return 2400
+        price_cents = 2400
+    cache.set(PRICE_CACHE_KEY, price_cents, settings.USSD_PRICE_CACHE_SECONDS)
+    return price_cents
+
+
+def order_confirmation(request, session, done_step):
+    """
+    Price the order held in session.data, open (or reprice) its pending
+    transaction and ask the buyer to confirm. Reached from the phone step, or
+    straight from quantity when a returning customer took the saved details.
+    """
+    session_id = session.session_id
+    price_cents = get_wassce_price_cents()
+    qty = int(session.data.get("qty", 1))
+    total_cents = price_cents * qty
+    keys = transaction_match_keys(session.data, session_mobile=session.mobile)
+    # one transaction per session: client_reference is unique, so a
+    # repeated or concurrent hop finds the row instead of adding one
+    tx, created = Transaction.objects.get_or_create_recent(
+        client_reference=session_id,
+        defaults={
+            "session": session,
+            "amount_cents": total_cents,
+            "status": "pending",
+            **keys,
+        },
+    )
+    if not created:
+        # only a still-pending order may be repriced; created_at picks its partition
+        Transaction.objects.filter(
+            pk=tx.pk, created_at=tx.created_at, status="pending"
+        ).update(
+            amount_cents=total_cents,
+            updated_at=timezone.now(),
+            **transaction_match_keys(session.data, tx.mobile, session.mobile),
+        )
+    session.data["transaction_id"] = tx.id
+    session.step = 5
+    session.update_row()
+    funnel.record(done_step, "advanced")
+    funnel.record(5, "entered")
+
+    total_ghs = total_cents / 100
+    resp_confirm = {
+        "SessionId": session_id,
+        "Type": "response",
+        "Message": f"Confirm purchase of {qty} WASSCE checker(s) for GHS {total_ghs:.2f}\n1. Confirm\n2. Cancel",
+        "Label": "Confirm Purchase",
+        "ClientState": "",
+        "DataType": "input",
+        "FieldType": "number",
+    }
+    log.info("INCOMING: %s", request.body.decode())
+    log.info("OUTGOING: %s", resp_confirm)
+    return JsonResponse(resp_confirm)
 
 
 # Note: email notify helper removed; retrieval requests are logged to DB (admin panel)
@@ -47,6 +111,8 @@ def get_wassce_price_cents():
 
 @csrf_exempt
 @require_POST
+@captured("interaction")
+@deadline_bound
 def interaction(request):
     """Service Interaction URL - Hubtel will POST JSON here"""
     try:
@@ -64,7 +130,7 @@ def interaction(request):
     client_state = payload.get("ClientState", "")
 
     # load or create session
-    session, created = USSDSession.objects.get_or_create(
+    session, created = USSDSession.objects.get_or_create_recent(
         session_id=session_id,
         defaults={
             "mobile": mobile,
@@ -76,18 +142,30 @@ def interaction(request):
     if not created:
         session.sequence = sequence
         session.client_state = client_state
-        session.save()
+        session.update_row()
 
     # Interpret Type
     if msg_type == "Initiation":
         # start flow
         session.step = 1
         session.data = {}
-        session.save()
+        menu = "Welcome to Jel Services\n1. Buy WASSCE Results Checker\n2. Retrieve Voucher"
+        # returning customer: offer last purchase's details (read once, kept
+        # in the session for the rest of the flow)
+        profile = (
+            CustomerProfile.objects.filter(mobile=normalize_msisdn(mobile))
+            .values("name", "receiver_phone")
+            .first()
+        )
+        if profile:
+            session.data["profile"] = profile
+            menu += f"\n3. Buy for {profile['name']}, {profile['receiver_phone']}"
+        session.update_row()
+        funnel.record(1, "entered")
         response = {
             "SessionId": session_id,
             "Type": "response",
-            "Message": "Welcome to Jel Services\n1. Buy WASSCE Results Checker\n2. Retrieve Voucher",
+            "Message": menu,
             "Label": "Main Menu",
             "ClientState": "",  # optional
             "DataType": "input",
@@ -108,9 +186,17 @@ def interaction(request):
         # 4 -> receiver phone
         # 5 -> confirm (1 confirm, 2 cancel)
         if session.step == 1:
-            if text == "1":
+            profile = session.data.get("profile")
+            if text == "3" and profile:
+                # buy with the saved details: quantity, then straight to confirm
+                session.data["name"] = profile["name"]
+                session.data["receiver_phone"] = profile["receiver_phone"]
+                funnel.record(1, "returning")
+            if text == "1" or (text == "3" and profile):
                 session.step = 2
-                session.save()
+                session.update_row()
+                funnel.record(1, "advanced")
+                funnel.record(2, "entered")
                 resp = {
                     "SessionId": session_id,
                     "Type": "response",
@@ -125,7 +211,9 @@ def interaction(request):
                 return JsonResponse(resp)
             elif text == "2":
                 session.step = 101
-                session.save()
+                session.update_row()
+                funnel.record(1, "advanced")
+                funnel.record(101, "entered")
 
                 resp_rv_name = {
                     "SessionId": session_id,
@@ -164,6 +252,7 @@ def interaction(request):
                 if qty <= 0:
                     raise ValueError
             except Exception:
+                funnel.record(2, "invalid")
                 return JsonResponse(
                     {
                         "SessionId": session_id,
@@ -176,8 +265,12 @@ def interaction(request):
                     }
                 )
             session.data["qty"] = qty
+            if session.data.get("receiver_phone"):
+                return order_confirmation(request, session, done_step=2)
             session.step = 3
-            session.save()
+            session.update_row()
+            funnel.record(2, "advanced")
+            funnel.record(3, "entered")
             resp_name = {
                 "SessionId": session_id,
                 "Type": "response",
@@ -195,7 +288,9 @@ def interaction(request):
             name = text
             session.data["name"] = name
             session.step = 4
-            session.save()
+            session.update_row()
+            funnel.record(3, "advanced")
+            funnel.record(4, "entered")
             resp_phone = {
                 "SessionId": session_id,
                 "Type": "response",
@@ -210,36 +305,8 @@ def interaction(request):
             return JsonResponse(resp_phone)
 
         if session.step == 4:
-            receiver_phone = text
-            session.data["receiver_phone"] = receiver_phone
-            # compute total
-            price_cents = get_wassce_price_cents()
-            qty = int(session.data.get("qty", 1))
-            total_cents = price_cents * qty
-            # create transaction (pending)
-            tx = Transaction.objects.create(
-                session=session,
-                client_reference=session.session_id,
-                amount_cents=total_cents,
-                status="pending",
-            )
-            session.data["transaction_id"] = tx.id
-            session.step = 5
-            session.save()
-
-            total_ghs = total_cents / 100
-            resp_confirm = {
-                "SessionId": session_id,
-                "Type": "response",
-                "Message": f"Confirm purchase of {qty} WASSCE checker(s) for GHS {total_ghs:.2f}\n1. Confirm\n2. Cancel",
-                "Label": "Confirm Purchase",
-                "ClientState": "",
-                "DataType": "input",
-                "FieldType": "number",
-            }
-            log.info("INCOMING: %s", request.body.decode())
-            log.info("OUTGOING: %s", resp_confirm)
-            return JsonResponse(resp_confirm)
+            session.data["receiver_phone"] = text
+            return order_confirmation(request, session, done_step=4)
 
         # --- Voucher Retrieval Flow Handlers (name -> phone -> lookup) ---
         if session.step == 101:
@@ -247,7 +314,9 @@ def interaction(request):
             session.data = session.data or {}
             session.data["rv_name"] = text
             session.step = 102
-            session.save()
+            session.update_row()
+            funnel.record(101, "advanced")
+            funnel.record(102, "entered")
 
             resp_rv_phone = {
                 "SessionId": session_id,
@@ -267,49 +336,26 @@ def interaction(request):
             session.data = session.data or {}
             session.data["rv_phone"] = text
             session.step = 103
-            session.save()
+            session.update_row()
+            funnel.record(102, "advanced")
 
             rv_name = (session.data.get("rv_name") or "").strip().lower()
             rv_phone = (text or "").strip()
 
-            def norm(p):
-                return re.sub(r"\D", "", str(p or ""))
-
-            rv_phone_n = norm(rv_phone)
-
-            # Search for transactions where stored name and phone match (successful payments preferred)
+            # newest transaction with the same name and phone, whatever its
+            # status, on the (match_name, match_phone) index
             found_tx = None
-            qs = Transaction.objects.order_by("-created_at")
-            for tx in qs:
-                try:
-                    # prefer transactions marked success; but check all
-                    sdata = getattr(tx.session, "data", {}) or {}
-                    sname = (sdata.get("name") or "").strip().lower()
-                    # receiver_phone may be in session data, or tx.mobile or session.mobile
-                    rphone = (
-                        sdata.get("receiver_phone")
-                        or getattr(tx, "mobile", None)
-                        or tx.session.mobile
-                    )
-                    if (
-                        rv_name
-                        and sname
-                        and rv_name == sname
-                        and rv_phone_n
-                        and norm(rphone).endswith(rv_phone_n)
-                    ):
-                        # optionally ensure payment was successful
-                        if tx.status == "success" or tx.order_id:
-                            found_tx = tx
-                            break
-                        else:
-                            # still consider pending/other statuses as potential matches
-                            found_tx = tx
-                            break
-                except Exception:
-                    continue
+            match_name, match_phone = name_key(rv_name), phone_key(rv_phone)
+            if match_name and match_phone:
+                found_tx = (
+                    Transaction.objects.filter(match_name=match_name, match_phone=match_phone)
+                    .defer("extra")
+                    .order_by("-created_at")
+                    .first()
+                )
 
             if found_tx:
+                funnel.record(102, "matched")
                 # Log a RetrievalRequest pointing to the matched transaction
                 rr = RetrievalRequest.objects.create(
                     session=session,
@@ -319,6 +365,7 @@ def interaction(request):
                     status="matched",
                     notes={"matched_tx_status": found_tx.status},
                 )
+                voucher_requests_matched.send(sender=RetrievalRequest, requests=[rr])
 
                 resp_rv_received = {
                     "SessionId": session_id,
@@ -335,6 +382,7 @@ def interaction(request):
                 log.info("OUTGOING: %s", resp_rv_received)
                 return JsonResponse(resp_rv_received)
             else:
+                funnel.record(102, "no_record")
                 # Log a RetrievalRequest with no match so admin can follow up
                 rr = RetrievalRequest.objects.create(
                     session=session,
@@ -366,17 +414,37 @@ def interaction(request):
         if session.step == 5:
             if text == "1":
                 # Confirm -> Hubtel expects AddToCart or Release + Hubtel will send to checkout
-                tx_id = session.data.get("transaction_id")
-                tx = Transaction.objects.get(id=tx_id)
+                # conditional update: never overwrite a transaction that
+                # fulfillment has already settled
+                pending = Transaction.objects.filter(
+                    client_reference=session_id, status="pending"
+                )
+                changes = {"extra": {"initiated_by": mobile}, "updated_at": timezone.now()}
+                # hot window first, then an order opened before it
+                confirmed = pending.recent().update(**changes) or pending.update(**changes)
+                amounts = Transaction.objects.filter(client_reference=session_id).values_list(
+                    "amount_cents", flat=True
+                )
+                amount_cents = amounts.recent().first() or amounts.first()
+                if not confirmed:
+                    resp_processed = {
+                        "SessionId": session_id,
+                        "Type": "release",
+                        "Message": "This order has already been processed.",
+                        "Label": "Order Processed",
+                        "DataType": "display",
+                        "FieldType": "text",
+                    }
+                    log.info("INCOMING: %s", request.body.decode())
+                    log.info("OUTGOING: %s", resp_processed)
+                    return JsonResponse(resp_processed)
+                funnel.record(5, "add_to_cart")
                 # required to return Type: "AddToCart" and include Item object
                 item = {
                     "ItemName": "WASSCE Checker",
                     "Qty": session.data.get("qty", 1),
-                    "Price": tx.amount_ghs(),
+                    "Price": amount_cents / 100,
                 }
-                # Save extra if needed
-                tx.extra = {"initiated_by": mobile}
-                tx.save()
                 # Hubtel will now present the checkout (user will make payment) and upon success call Service Fulfillment URL.
                 resp_payment = {
                     "SessionId": session_id,
@@ -391,8 +459,9 @@ def interaction(request):
                 log.info("OUTGOING: %s", resp_payment)
                 return JsonResponse(resp_payment)
             else:
+                funnel.record(5, "cancelled")
                 session.step = 0
-                session.save()
+                session.update_row()
                 resp_payment_cancelled = {
                     "SessionId": session_id,
                     "Type": "release",
@@ -406,8 +475,9 @@ def interaction(request):
                 return JsonResponse(resp_payment_cancelled)
 
     if msg_type == "Timeout":
+        funnel.record(session.step, "timed_out")
         session.step = 0
-        session.save()
+        session.update_row()
         resp_payment_timedout = {
             "SessionId": session_id,
             "Type": "release",
@@ -421,6 +491,9 @@ def interaction(request):
         return JsonResponse(resp_payment_timedout)
 
     # default fallback
+    if msg_type == "Response":
+        # input the current step didn't accept (e.g. '3' at the main menu)
+        funnel.record(session.step, "invalid")
     resp_payment_error = {
         "SessionId": session_id,
         "Type": "release",
@@ -434,8 +507,27 @@ def interaction(request):
     return JsonResponse(resp_payment_error)
 
 
+def remember_customer(tx):
+    """Save the buyer's details from a paid order for the returning-customer offer."""
+    try:
+        sessions = USSDSession.objects.filter(pk=tx.session_id).values_list("mobile", "data")
+        # the session opened shortly before its order, so a day's bound keeps
+        # the read on the order's partition; an older session still resolves
+        mobile, data = (
+            sessions.filter(
+                created_at__lte=tx.created_at,
+                created_at__gte=tx.created_at - timedelta(days=1),
+            ).first()
+            or sessions.get()
+        )
+        CustomerProfile.remember(mobile, data.get("name"), data.get("receiver_phone"))
+    except Exception:
+        logger.exception("Could not update customer profile for TX %s", tx.pk)
+
+
 @csrf_exempt
 @require_POST
+@captured("fulfillment")
 def fulfillment(request):
     """Service Fulfillment URL - Hubtel calls this after payment is made according to documentation"""
     try:
@@ -451,11 +543,13 @@ def fulfillment(request):
     status = (order_info.get("Status") or payload.get("ServiceStatus") or "").lower()
 
     try:
-        tx = (
+        matching = (
             Transaction.objects.filter(client_reference=session_id)
+            .only("id", "session_id", "order_id", "status", "created_at")
             .order_by("-created_at")
-            .first()
         )
+        # hot window first; a late fulfillment for an older order still resolves
+        tx = matching.recent().first() or matching.first()
 
         if not tx:
             logger.warning("No transaction found for session %s", session_id)
@@ -463,10 +557,13 @@ def fulfillment(request):
 
         # Mark transaction result
         if status == "paid":
+            first_payment = tx.status != "success"  # Hubtel may resend the same order
             tx.order_id = order_id
             tx.status = "success"
-            tx.extra.update({"order_info": order_info})
-            tx.save()
+            tx.update_row("order_id", "status")
+            ProviderPayload.record(tx, "order_info", order_info)
+            if first_payment:
+                remember_customer(tx)
 
             # Prepare Hubtel callback payload
             callback_payload = {
@@ -475,19 +572,10 @@ def fulfillment(request):
                 "Message": "Service delivered successfully",
             }
 
-            callback_url = "https://gs-callback.hubtel.com:9055/callback"
-            # callback_url = "https://webhook.site/af6f4284-0845-45ef-8b29-1bc44dcc21d4"
-
             # Attempt callback with retry logic
             for attempt in range(3):
                 try:
-                    response = requests.post(
-                        callback_url,
-                        json=callback_payload,
-                        timeout=10,
-                        headers={"Content-Type": "application/json"},
-                        proxies=get_proxies(),
-                    )
+                    response = post_callback(callback_payload)
                     logger.info(
                         "Callback attempt %s to Hubtel: %s",
                         attempt + 1,
@@ -495,6 +583,12 @@ def fulfillment(request):
                     )
                     if response.status_code == 200:
                         break  # success, no need to retry
+                except CircuitOpenError as e:
+                    # Hubtel callback endpoint is down, don't hold the worker
+                    logger.critical(
+                        "Callback skipped for order %s: %s", order_id, e
+                    )
+                    break
                 except Exception as e:
                     logger.error("Callback attempt %s failed: %s", attempt + 1, str(e))
                     if attempt == 2:
@@ -504,8 +598,8 @@ def fulfillment(request):
 
         else:
             tx.status = "failed"
-            tx.extra.update({"order_info": order_info})
-            tx.save()
+            tx.update_row("status")
+            ProviderPayload.record(tx, "order_info", order_info)
 
             # Optional: notify Hubtel of failed service (optional)
             failed_payload = {
@@ -514,13 +608,7 @@ def fulfillment(request):
                 "Message": "Payment received but service failed to deliver",
             }
             try:
-                requests.post(
-                    "https://gs-callback.hubtel.com:9055/callback",
-                    # "https://webhook.site/af6f4284-0845-45ef-8b29-1bc44dcc21d4",
-                    json=failed_payload,
-                    timeout=10,
-                    proxies=get_proxies(),
-                )
+                post_callback(failed_payload)
             except Exception as e:
                 logger.warning("Failed to send failure callback: %s", e)
 
@@ -528,61 +616,3 @@ def fulfillment(request):
         logger.exception("Error processing fulfillment: %s", e)
 
     return JsonResponse({"ok": True})
-
-
-# def check_transaction_status(client_reference):
-#     """
-#     Returns the JSON response from Hubtel transaction status endpoint.
-#     Uses the POS_SALES_ID from environment variables.
-#     """
-#     pos_sales_id = settings.POS_SALES_ID
-#     url = f"https://api-txnstatus.hubtel.com/transactions/{pos_sales_id}/status"
-#     params = {"clientReference": client_reference}
-
-#     try:
-#         resp = requests.get(
-#             url,
-#             params=params,
-#             timeout=15,
-#             proxies=get_proxies(),
-#         )
-#         resp.raise_for_status()
-#         return resp.json()
-#     except Exception as e:
-#         logger.error("Error checking transaction status: %s", e)
-#         return {"error": str(e)}
-
-
-
-def check_transaction_status(client_reference):
-    """
-    Returns the JSON response from Hubtel transaction status endpoint.
-    """
-    pos_sales_id = settings.POS_SALES_ID
-    url = f"https://api-txnstatus.hubtel.com/transactions/{pos_sales_id}/status"
-    params = {"clientReference": client_reference}
-
-    # Log INCOMING request (same pattern as your USSD INCOMING)
-    logger.info("INCOMING (STATUS CHECK): %s - Params: %s", url, params)
-
-    try:
-        resp = requests.get(
-            url,
-            params=params,
-            timeout=15,
-            proxies=get_proxies(),
-        )
-
-        # Log OUTGOING raw response
-        try:
-            logger.info("OUTGOING (STATUS CHECK): %s", resp.text)
-        except Exception:
-            logger.info("OUTGOING (STATUS CHECK): <non-text-response>")
-
-        resp.raise_for_status()
-        return resp.json()
-
-    except Exception as e:
-        logger.error("ERROR (STATUS CHECK): %s", e)
-        return {"error": str(e)}
-
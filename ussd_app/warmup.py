@@ -0,0 +1,47 @@
+"""
+Warm-up for freshly started workers.
+
+Run before a worker takes traffic (gunicorn post_worker_init hook or
+`python manage.py warmup`) so the first Hubtel request after a cold start
+doesn't pay for the price lookup and URL resolution, which are cached per
+process.
+
+The database connection is not primed: Django connections are per thread,
+and gthread and uvicorn workers serve requests on other threads than the one
+running post_worker_init, so each request thread still opens its own
+connection on its first query (and keeps it for CONN_MAX_AGE).
+"""
+
+import logging
+import time
+
+from django.db import connection
+from django.urls import resolve, reverse
+
+log = logging.getLogger("ussd")
+
+HOT_PATHS = ("interaction", "fulfillment")
+
+
+def warm_up():
+    """Prime the hot path; returns the time spent per phase in milliseconds."""
+    timings = {}
+
+    start = time.perf_counter()
+    from .views import get_wassce_price_cents
+
+    get_wassce_price_cents()
+    timings["price_cache"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in HOT_PATHS:
+        resolve(reverse(name))
+    reverse("admin:index")
+    timings["url_resolver"] = time.perf_counter() - start
+
+    # the price lookup connected this thread, which serves no requests
+    connection.close()
+
+    timings = {phase: round(t * 1000, 2) for phase, t in timings.items()}
+    log.info("Warm-up done: %s", timings)
+    return timings